@@ -25,21 +25,123 @@ import time
 import cv2
 import numpy as np
 import _Widget
-from _Platform_Convergence import Config
-from PIL import ImageGrab
-from tkinter import *
+import _Needle_Cache
+import _Location_Hints
+import _Tile_Index
+import _Region_Registry
+import _Element_Map
+import _Capture_Convergence
+import _Screen_Stream
+import _Image_Codec
+import _Workers
+from _Platform_Convergence import Config, SimpleRPAException
+from _Image_Codec import ImageFormats
 
+PYRAMID_MIN_NEEDLE = 4
+WAIT_BACKOFF_FACTOR = 1.5
 
-def get_pixel_color(pt, use_widget=None, duration=0):
+
+class MatchModes:
+    """
+    The search strategies available to find_image.
+    """
+    EXACT = 'exact'
+    PYRAMID = 'pyramid'
+    TILED = 'tiled'
+    FEATURES = 'features'
+
+
+def frozen(frame_id=None):
+    """
+    Returns a context manager that freezes the screen so every query inside the block reads the same captured frame.
+    The frame is recaptured automatically once mouse or keyboard input has been injected.
+    :param frame_id: The id of a previously frozen frame to reuse if it is still current.
+    :return: contextmanager yielding the frame id
+    """
+    return _Capture_Convergence.frozen(frame_id)
+
+
+def capture_frame():
+    """
+    Captures the whole desktop into a new frame that can be compared with diff.
+    :return: Frame
+    """
+    return _Capture_Convergence.capture_frame()
+
+
+def diff(frame_a, frame_b, region=None, threshold=None, monitor=None):
+    """
+    Compares two frames and returns the areas that changed between them. Pixels whose channels differ by more than the
+    threshold are changed, changed pixels closer than Config.diff_merge_distance are merged into one area.
+    :param frame_a: The earlier Frame.
+    :param frame_b: The later Frame.
+    :param region: Optional tuple area rectangle (x, y, w, h) to compare, defaults to the whole screen or monitor.
+    :param threshold: The per channel difference a pixel must exceed to count as changed, defaults to the config.
+    :param monitor: Optional index or name of the monitor the region is relative to.
+    :return: tuple(tuple(x,y,w,h,ratio)[], ratio) of the changed areas in desktop coordinates with the fraction of
+    their pixels that changed, and the fraction of the whole compared area that changed.
+    """
+    if threshold is None:
+        threshold = Config.diff_threshold
+    bbox = _clip_bbox(_clip_bbox(_search_bbox(region, monitor), frame_a.bbox), frame_b.bbox)
+    if bbox[2] <= bbox[0] or bbox[3] <= bbox[1]:
+        return [], 0.0
+
+    # region Threshold the largest channel difference of every pixel.
+    delta = cv2.absdiff(frame_a.crop(bbox), frame_b.crop(bbox)).max(axis=2)
+    mask = np.where(delta > threshold, 255, 0).astype(np.uint8)
+    total = cv2.countNonZero(mask)
+    if total == 0:
+        return [], 0.0
+    # endregion
+
+    # region Merge nearby changes and measure each merged area on the undilated mask.
+    reach = int(Config.diff_merge_distance)
+    merged = cv2.dilate(mask, np.ones((2 * reach + 1, 2 * reach + 1), dtype=np.uint8)) if reach > 0 else mask
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(merged, connectivity=8)
+    changes = list()
+    for i in range(1, count):
+        x, y, w, h = stats[i][:4]
+        part = np.where(labels[y:y + h, x:x + w] == i, mask[y:y + h, x:x + w], 0).astype(np.uint8)
+        px, py, pw, ph = cv2.boundingRect(cv2.findNonZero(part))
+        changes.append((int(x + px + bbox[0]), int(y + py + bbox[1]), int(pw), int(ph),
+                        cv2.countNonZero(part) / float(pw * ph)))
+    # endregion
+
+    changes.sort(key=lambda c: (c[1], c[0]))
+    return changes, total / float((bbox[2] - bbox[0]) * (bbox[3] - bbox[1]))
+
+
+def diff_last(region=None, threshold=None, monitor=None):
+    """
+    Captures a new frame and compares it with the last frame the server captured. Without a last frame the whole area
+    is reported as changed.
+    :param region: Optional tuple area rectangle (x, y, w, h) to compare, defaults to the whole screen or monitor.
+    :param threshold: The per channel difference a pixel must exceed to count as changed, defaults to the config.
+    :param monitor: Optional index or name of the monitor the region is relative to.
+    :return: tuple(previous frame id or None, new frame id, changed areas, ratio) as returned by diff
+    """
+    previous = _Capture_Convergence.last_frame()
+    frame = _Capture_Convergence.capture_frame()
+    if previous is None:
+        left, top, right, bottom = _search_bbox(region, monitor)
+        return None, frame.frame_id, [(left, top, right - left, bottom - top, 1.0)], 1.0
+    changes, ratio = diff(previous, frame, region, threshold, monitor)
+    return previous.frame_id, frame.frame_id, changes, ratio
+
+
+def get_pixel_color(pt, use_widget=None, duration=0, monitor=None):
     """
     Returns the pixel color of the specified coordinate.
     :param pt: The point to look at.
     :param use_widget: If true displays the field highlighter widget.
     :param duration: The amount of time to display the widget for.
+    :param monitor: Optional index or name of the monitor the point is relative to.
     :return: Color
     """
-    image = ImageGrab.grab(bbox=(pt[0], pt[1], pt[0] + 1, pt[1] + 1))
-    pixel = image.getpixel((0, 0))
+    pt = _on_monitor(pt, monitor)
+    frame = _Capture_Convergence.grab((pt[0], pt[1], pt[0] + 1, pt[1] + 1))
+    pixel = tuple(int(c) for c in frame[0, 0])
     if use_widget is None:
         use_widget = Config.use_widgets_by_default
         duration = Config.default_widget_duration
@@ -48,14 +150,16 @@ def get_pixel_color(pt, use_widget=None, duration=0):
     return pixel
 
 
-def get_known_color(pt, use_widget=None, duration=0):
+def get_known_color(pt, use_widget=None, duration=0, monitor=None):
     """
     Returns the nearest known color of the specified coordinate.
     :param pt: The point to look at.
     :param use_widget: If true displays the field highlighter widget.
     :param duration: The amount of time to display the widget for.
+    :param monitor: Optional index or name of the monitor the point is relative to.
     :return: Color
     """
+    pt = _on_monitor(pt, monitor)
     known_colors = KnownColors.get_known_colors()
     if use_widget is None:
         use_widget = Config.use_widgets_by_default
@@ -65,14 +169,16 @@ def get_known_color(pt, use_widget=None, duration=0):
     return _get_color(pt, known_colors)
 
 
-def get_console_color(pt, use_widget=None, duration=0):
+def get_console_color(pt, use_widget=None, duration=0, monitor=None):
     """
     Returns the nearest console color of the specified coordinate.
     :param pt: The point to look at.
     :param use_widget: If true displays the field highlighter widget.
     :param duration: The amount of time to display the widget for.
+    :param monitor: Optional index or name of the monitor the point is relative to.
     :return: Color
     """
+    pt = _on_monitor(pt, monitor)
     console_colors = KnownColors.get_console_colors()
     if use_widget is None:
         use_widget = Config.use_widgets_by_default
@@ -82,6 +188,81 @@ def get_console_color(pt, use_widget=None, duration=0):
     return _get_color(pt, console_colors)
 
 
+def get_pixel_colors(points, use_widget=None, duration=0, monitor=None):
+    """
+    Returns the pixel colors of all the specified coordinates from a single capture of their bounding box.
+    :param points: The list of points to look at.
+    :param use_widget: If true displays the field highlighter widget around the sampled area.
+    :param duration: The amount of time to display the widget for.
+    :param monitor: Optional index or name of the monitor the points are relative to.
+    :return: Color[]
+    """
+    pixels = _get_pixels([_on_monitor(pt, monitor) for pt in points], use_widget, duration)
+    return [tuple(int(c) for c in p) for p in pixels]
+
+
+def get_known_colors(points, use_widget=None, duration=0, monitor=None):
+    """
+    Returns the nearest known colors of all the specified coordinates from a single capture of their bounding box.
+    :param points: The list of points to look at.
+    :param use_widget: If true displays the field highlighter widget around the sampled area.
+    :param duration: The amount of time to display the widget for.
+    :param monitor: Optional index or name of the monitor the points are relative to.
+    :return: Color[]
+    """
+    pixels = _get_pixels([_on_monitor(pt, monitor) for pt in points], use_widget, duration)
+    return _nearest_colors(pixels, KnownColors.get_known_colors())
+
+
+def get_console_colors(points, use_widget=None, duration=0, monitor=None):
+    """
+    Returns the nearest console colors of all the specified coordinates from a single capture of their bounding box.
+    :param points: The list of points to look at.
+    :param use_widget: If true displays the field highlighter widget around the sampled area.
+    :param duration: The amount of time to display the widget for.
+    :param monitor: Optional index or name of the monitor the points are relative to.
+    :return: Color[]
+    """
+    pixels = _get_pixels([_on_monitor(pt, monitor) for pt in points], use_widget, duration)
+    return _nearest_colors(pixels, KnownColors.get_console_colors())
+
+
+def _get_pixels(points, use_widget=None, duration=0):
+    """
+    Captures the bounding box of the specified points once and gathers their pixels.
+    :param points: The list of points to look at.
+    :param use_widget: If true displays the field highlighter widget around the sampled area.
+    :param duration: The amount of time to display the widget for.
+    :return: numpy.array of shape (len(points), 3)
+    """
+    if len(points) == 0:
+        return np.zeros((0, 3), dtype=np.uint8)
+    pts = np.array([(p[0], p[1]) for p in points], dtype=np.int64)
+    left, top = pts.min(axis=0)
+    right, bottom = pts.max(axis=0) + 1
+    frame = _Capture_Convergence.grab((left, top, right, bottom))
+    pixels = frame[pts[:, 1] - top, pts[:, 0] - left]
+    if use_widget is None:
+        use_widget = Config.use_widgets_by_default
+        duration = Config.default_widget_duration
+    if use_widget:
+        _Widget.Widget._show_widget_rect((int(left), int(top), int(right - left), int(bottom - top)), duration)
+    return pixels
+
+
+def _nearest_colors(pixels, color_list):
+    """
+    Finds the closest color in the list for every pixel. Ties go to the color listed last, the same as _get_color.
+    :param pixels: The numpy array of RGB pixels.
+    :param color_list: The list of known colors to find the closest match to.
+    :return: Color[]
+    """
+    palette = np.array([(c.r, c.g, c.b) for c in color_list], dtype=np.int32)
+    delta = np.abs(pixels[:, np.newaxis, :].astype(np.int32) - palette[np.newaxis, :, :]).sum(axis=2)
+    idx = len(color_list) - 1 - np.argmin(delta[:, ::-1], axis=1)
+    return [color_list[i] for i in idx]
+
+
 def _get_color(pt, color_list):
     """
     Gets the color at the specified point on the screen.
@@ -126,15 +307,17 @@ def _get_color(pt, color_list):
     # endregion
 
 
-def capture(rct, use_widget=None, duration=0):
+def capture(rct, use_widget=None, duration=0, monitor=None):
     """
     Captures the area of the specified rectangle.
-    :param rct: Tuple area rectangle to capture off the screen.
+    :param rct: Tuple area rectangle to capture off the screen, may be None to capture the whole monitor.
     :param use_widget: If true displays the field highlighter widget.
     :param duration: The amount of time to display the widget for.
+    :param monitor: Optional index or name of the monitor the rectangle is relative to. Only that monitor is captured.
     :return: image
     """
-    image = ImageGrab.grab(bbox=(rct[0], rct[1], rct[2], rct[3]), all_screens=True)
+    rct = _monitor_bbox(rct, monitor)
+    image = _Capture_Convergence.grab_image((rct[0], rct[1], rct[2], rct[3]))
     if use_widget is None:
         use_widget = Config.use_widgets_by_default
         duration = Config.default_widget_duration
@@ -143,15 +326,29 @@ def capture(rct, use_widget=None, duration=0):
     return image
 
 
-def capture_to_file(rct, file, use_widget=None, duration=0):
+def encode(image, format=ImageFormats.RAW, quality=None, scale=1):
+    """
+    Encodes a captured image for transport.
+    :param image: The image returned by capture.
+    :param format: The ImageFormats encoding to use.
+    :param quality: The 1-100 quality for jpeg and webp.
+    :param scale: The factor to downsample the image by before encoding, 1 keeps the original size.
+    :return: EncodedImage
+    """
+    return _Image_Codec.encode(np.asarray(image.convert('RGB')), format, quality, scale)
+
+
+def capture_to_file(rct, file, use_widget=None, duration=0, monitor=None):
     """
     Captures the area of the screen and save it to the specified file.
-    :param rct: Tuple area rectangle to capture off the screen.
+    :param rct: Tuple area rectangle to capture off the screen, may be None to capture the whole monitor.
     :param file: The name of the file to save the image to.
     :param use_widget: If true displays the field highlighter widget.
     :param duration: The amount of time to display the widget for.
+    :param monitor: Optional index or name of the monitor the rectangle is relative to. Only that monitor is captured.
     :return: void
     """
+    rct = _monitor_bbox(rct, monitor)
     image = capture(rct)
     if use_widget is None:
         use_widget = Config.use_widgets_by_default
@@ -163,47 +360,728 @@ def capture_to_file(rct, file, use_widget=None, duration=0):
     return
 
 
-def find_image(file, threshold=0.9, use_widget=None, duration=0):
+def stream_frame(stream_id=None, ack=None, region=None):
+    """
+    Captures the next frame of a tile delta stream of the screen. Only the tiles that changed since the acknowledged
+    frame are returned, along with periodic keyframes.
+    :param stream_id: The id of the stream to continue or None to start a new one.
+    :param ack: The sequence number of the last frame the client received or None.
+    :param region: Optional tuple area rectangle (x, y, w, h) to stream, defaults to the whole screen.
+    :return: tuple(stream_id, StreamFrame)
+    """
+    stream = _Screen_Stream.get_stream(stream_id, _search_bbox(region))
+    with _Capture_Convergence.thawed():
+        return stream.stream_id, stream.next_frame(None if ack is None else int(ack))
+
+
+def close_stream(stream_id):
+    """
+    Releases the state the server keeps for a tile delta stream.
+    :param stream_id: The id of the stream to close.
+    :return: void
+    """
+    _Screen_Stream.close_stream(stream_id)
+
+
+def wait_for_change(rct=None, timeout=10.0):
+    """
+    Blocks until the specified area of the screen is repainted or the timeout expires.
+    :param rct: Tuple area rectangle (x, y, w, h) to watch. None watches the whole screen.
+    :param timeout: The maximum number of seconds to wait.
+    :return: bool
+    """
+    return _Capture_Convergence.wait_for_change(rct, timeout)
+
+
+def find_image(file, threshold=0.9, use_widget=None, duration=0, region=None, mode=MatchModes.EXACT,
+               max_results=None, best_only=False, suppress=None, with_scores=False, monitor=None, use_hints=None):
     """
     Searches the screen to locate image matches of the specified image file.
     :param file: The name of the file to load reference image from.
     :param threshold: The matching threshold to use when searching.
-    :return: tuple(x,y,w,h)[]
+    :param use_widget: If true displays the field highlighter widget over every match.
+    :param duration: The amount of time to display the widget for.
+    :param region: Optional tuple area rectangle (x, y, w, h) to restrict the search to.
+    :param mode: The MatchModes search strategy to use.
+    :param max_results: Optional maximum number of matches to return, best scores first.
+    :param best_only: If true only the single best match is returned.
+    :param suppress: If true overlapping matches are collapsed onto the best scoring one, defaults to the config.
+    :param with_scores: If true every location also carries its match score as a fifth element.
+    :param monitor: Optional index or name of the monitor to search, the region is then relative to the monitor.
+    Locations are always returned in desktop coordinates.
+    :param use_hints: If true the locations the image was last found at are checked before searching the whole
+    area, defaults to the config.
+    :return: tuple(x,y,w,h)[] or tuple(x,y,w,h,score)[]
     """
-    if file is None or file == '':
-        raise FileNotFoundError("The paramater 'file' must be populated.")
-
-    # Load the image file to look for.
-    img = cv2.imread(file)
-
-    # region Get the screen width and height.
-    tkr = Tk()
-    width = tkr.winfo_screenwidth()
-    height = tkr.winfo_screenheight()
-    # endregion
+    return find_images([file], threshold, use_widget, duration, region, mode, max_results, best_only, suppress,
+                       with_scores, monitor, use_hints)[file]
 
-    # Capture the screen.
-    screen = np.array(ImageGrab.grab(bbox=(0, 0, width, height), all_screens=True))
 
-    # region Seach for image file on screen and return found locations.
-    haystack = cv2.cvtColor(screen, cv2.COLOR_BGR2GRAY)
-    needle = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    w, h = needle.shape[::-1]
-    res = cv2.matchTemplate(haystack, needle, cv2.TM_CCOEFF_NORMED)
+def find_images(files, threshold=0.9, use_widget=None, duration=0, region=None, mode=MatchModes.EXACT,
+                max_results=None, best_only=False, suppress=None, with_scores=False, monitor=None, use_hints=None):
+    """
+    Searches the screen for several image files at once. The screen is captured and converted only once and every
+    image is matched against that same capture.
+    :param files: The names of the files to load reference images from.
+    :param threshold: The matching threshold to use when searching.
+    :param use_widget: If true displays the field highlighter widget over every match.
+    :param duration: The amount of time to display the widget for.
+    :param region: Optional tuple area rectangle (x, y, w, h) to restrict the search to.
+    :param mode: The MatchModes search strategy to use.
+    :param max_results: Optional maximum number of matches to return per file, best scores first.
+    :param best_only: If true only the single best match of every file is returned.
+    :param suppress: If true overlapping matches are collapsed onto the best scoring one, defaults to the config.
+    :param with_scores: If true every location also carries its match score as a fifth element.
+    :param monitor: Optional index or name of the monitor to search, the region is then relative to the monitor.
+    Locations are always returned in desktop coordinates.
+    :param use_hints: If true the locations the images were last found at are checked before searching the whole
+    area, defaults to the config.
+    :return: dict of file to tuple(x,y,w,h)[] or tuple(x,y,w,h,score)[]
+    """
+    # Load the image files to look for, decoded images are kept in the needle cache.
+    needles = dict()
+    for file in files:
+        needles[file] = _Needle_Cache.needles.get(file)
+        if mode != MatchModes.FEATURES and needles[file].std == 0:
+            raise SimpleRPAException("The image file '" + str(file) + "' is a single flat color, it would match "
+                                     "everywhere.")
 
-    loc = np.where(res >= threshold)
+    # region Get the area of the screen to search.
+    bounds = _search_bbox(region, monitor)
+    left, top, right, bottom = bounds
+    results = dict((file, list()) for file in needles)
+    if right <= left or bottom <= top or (mode != MatchModes.FEATURES and all(
+            right - left < n.width or bottom - top < n.height for n in needles.values())):
+        return results
+    # endregion
 
+    # region Resolve the defaults.
+    limit = 1 if best_only else max_results
+    if suppress is None:
+        suppress = Config.suppress_overlapping_matches
+    if use_hints is None:
+        use_hints = Config.location_hints
     if use_widget is None:
         use_widget = Config.use_widgets_by_default
         duration = Config.default_widget_duration
-    lst = list()
-    for i in range(len(loc[0])):
-        rect = (loc[1][i], loc[0][i], w, h)
-        lst.append(rect)
-        if use_widget:
-            _Widget.Widget._show_widget_rect(rect, duration)
-
-    return lst
+    # endregion
+
+    # region Search the area for every image file.
+    # Capture the screen, answers and hints are checked against the hashes of the tiles the search area covers.
+    hinted = use_hints and mode != MatchModes.FEATURES
+    if Config.result_cache or hinted:
+        screen, hashes = _Tile_Index.grab(bounds)
+    else:
+        screen, hashes = _Capture_Convergence.grab(bounds), None
+
+    frame = None
+    haystack = None
+    scene = None
+    for file, needle in needles.items():
+        key = ('find_image', needle.path, needle.signature, threshold, mode, limit, suppress, bounds)
+        hits = None
+        if Config.result_cache:
+            found, cached = _Tile_Index.results.get(key, hashes)
+            if found:
+                hits = list(cached)
+        if hits is None:
+            if frame is None:
+                # The grayscale and pyramid levels are derived once per frame and shared with other searches on it.
+                frame = _Capture_Convergence.frame_for(bounds, screen)
+            if hinted:
+                # Look where the image was found last time, as long as the rest of the area is unchanged.
+                hits = _hinted_match(frame, needle, threshold, bounds, hashes, limit, suppress)
+        if hits is None:
+            if haystack is None:
+                haystack = frame.gray(bounds)
+            if mode == MatchModes.FEATURES:
+                # The keypoints of the screen are only detected once and shared by every needle.
+                if scene is None:
+                    scene = _detect_features(haystack, Config.orb_scene_features)
+                hits = _feature_match(haystack, scene, needle, threshold)
+            else:
+                w, h = needle.width, needle.height
+                if right - left < w or bottom - top < h:
+                    continue
+                res = _match(haystack, needle.image, threshold, mode, needle.mask,
+                             lambda scale: (frame.level(scale, bounds), ((bounds[0] - frame.bbox[0]) % scale,
+                                                                         (bounds[1] - frame.bbox[1]) % scale)))
+                hits = [(x, y, w, h, score) for x, y, score in _select(res, threshold, w, h, limit, suppress)]
+            hits = [(x + left, y + top, w, h, score) for x, y, w, h, score in hits]
+        results[file] = hits
+        if Config.result_cache:
+            _Tile_Index.results.put(key, hashes, tuple(hits))
+        if hinted and (limit is None or len(hits) < int(limit)):
+            _Location_Hints.hints.record((needle.path, needle.signature, bounds), threshold, hits, hashes)
+    # endregion
+
+    # region Return found locations.
+    for file in results:
+        for rect in results[file]:
+            if use_widget:
+                _Widget.Widget._show_widget_rect(rect[:4], duration)
+        if not with_scores:
+            results[file] = [rect[:4] for rect in results[file]]
+    return results
+    # endregion
+
+
+def element_map(region=None, monitor=None):
+    """
+    Returns the candidate UI elements of an area of the screen, found by one contour detection pass. The map is cached
+    and when the screen changes only the area around the changed tiles is detected again.
+    :param region: Optional tuple area rectangle (x, y, w, h) to map, defaults to the whole screen or monitor.
+    :param monitor: Optional index or name of the monitor the region is relative to.
+    :return: Element[] in desktop coordinates, top to bottom then left to right
+    """
+    bounds = _search_bbox(region, monitor)
+    if bounds[2] <= bounds[0] or bounds[3] <= bounds[1]:
+        return []
+    return _Element_Map.maps.get(bounds)
+
+
+def _hinted_match(frame, needle, threshold, bounds, hashes, limit, suppress):
+    """
+    Matches the needle only around the locations a search of the same area last found it at. The hint is only trusted
+    if every tile of the area that changed since then touches one of those locations, the changed tiles are searched
+    again along with the locations so images drawn there since are found too. Otherwise the caller falls back to a
+    full search.
+    :param frame: The Frame of the searched area.
+    :param needle: The Needle to look for.
+    :param threshold: The matching threshold to use.
+    :param bounds: The (left, top, right, bottom) area being searched.
+    :param hashes: The tile hashes of the area now.
+    :param limit: Optional maximum number of matches to return.
+    :param suppress: If true overlapping matches are collapsed onto the best scoring one.
+    :return: tuple(x,y,w,h,score)[] or None on a miss
+    """
+    # region Find the areas around the last locations that must be searched again.
+    entry = _Location_Hints.hints.get((needle.path, needle.signature, bounds), threshold)
+    tiles = _Tile_Index.index.tiles(_Tile_Index.index.align(bounds))
+    if entry is None or len(entry[1]) != len(hashes) or len(tiles) != len(hashes):
+        _Location_Hints.hints.count(False)
+        return None
+    margin = int(Config.hint_margin)
+    areas = [[x - margin, y - margin, x + w + margin, y + h + margin] for x, y, w, h in entry[0]]
+    for tile, was, now in zip(tiles, entry[1], hashes):
+        if was == now:
+            continue
+        touched = [area for area in areas if tile[0] < area[2] and area[0] < tile[2] and tile[1] < area[3] and
+                   area[1] < tile[3]]
+        if len(touched) == 0:
+            _Location_Hints.hints.count(False)
+            return None
+        for area in touched:
+            area[:] = min(area[0], tile[0]), min(area[1], tile[1]), max(area[2], tile[2]), max(area[3], tile[3])
+    # endregion
+
+    # region Search those areas, a new match overlapping a changed tile lies within the needle size of it.
+    w, h = needle.width, needle.height
+    hits = dict()
+    for area in areas:
+        roi = _clip_bbox((area[0] - w + 1, area[1] - h + 1, area[2] + w - 1, area[3] + h - 1), bounds)
+        if roi[2] - roi[0] < w or roi[3] - roi[1] < h:
+            continue
+        res = _correlate(frame.gray(roi), needle.image, needle.mask)
+        for x, y, score in _select(res, threshold, w, h, limit, suppress):
+            hits[(x + roi[0], y + roi[1])] = max(score, hits.get((x + roi[0], y + roi[1]), score))
+    _Location_Hints.hints.count(True)
+    # endregion
+
+    # region Collapse matches found by more than one area.
+    keep = list()
+    for (x, y), score in sorted(hits.items(), key=lambda item: -item[1]):
+        if limit is not None and len(keep) >= int(limit):
+            break
+        if suppress and any(_overlap(x - k[0], y - k[1], w, h) > Config.match_overlap for k in keep):
+            continue
+        keep.append((x, y, w, h, score))
+    return keep
+    # endregion
+
+
+def _overlap(dx, dy, w, h):
+    """
+    Returns the intersection over union of two needle sized boxes.
+    :param dx: The horizontal distance between the boxes.
+    :param dy: The vertical distance between the boxes.
+    :param w: The width of the needle.
+    :param h: The height of the needle.
+    :return: float
+    """
+    overlap = max(0, w - abs(dx)) * max(0, h - abs(dy))
+    return overlap / float(2 * w * h - overlap)
+
+
+def wait_for_image(file, threshold=0.9, timeout=10.0, region=None, use_widget=None, duration=0,
+                   mode=MatchModes.EXACT, with_scores=False, monitor=None):
+    """
+    Waits on the server until the specified image file appears on the screen or the timeout expires. The screen is
+    searched again with an adaptive backoff, and only once the search area has been repainted when damage events
+    are available.
+    :param file: The name of the file to load reference image from.
+    :param threshold: The matching threshold to use when searching.
+    :param timeout: The maximum number of seconds to wait.
+    :param region: Optional tuple area rectangle (x, y, w, h) to restrict the search to.
+    :param use_widget: If true displays the field highlighter widget over every match.
+    :param duration: The amount of time to display the widget for.
+    :param mode: The MatchModes search strategy to use.
+    :param with_scores: If true every location also carries its match score as a fifth element.
+    :param monitor: Optional index or name of the monitor to search, the region is then relative to the monitor.
+    :return: tuple(x,y,w,h)[] or tuple(x,y,w,h,score)[], empty if the timeout expired
+    """
+    # A frozen frame never changes, so the screen is always read live while waiting.
+    with _Capture_Convergence.thawed():
+        deadline = time.monotonic() + timeout
+        tracker = _Capture_Convergence.get_tracker()
+        delay = Config.wait_backoff_min
+        left, top, right, bottom = _search_bbox(region, monitor)
+        watched = (left, top, right - left, bottom - top)
+        while True:
+            # region Search the screen, remembering where the change history stood before the capture.
+            sequence = tracker.sequence if tracker is not None else None
+            attempt = time.monotonic()
+            locs = find_image(file, threshold, use_widget, duration, region, mode, with_scores=with_scores,
+                              monitor=monitor)
+            if len(locs) > 0:
+                return locs
+            # endregion
+
+            # region Wait for the next attempt.
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return locs
+            if tracker is not None and not tracker.wait(watched, remaining, sequence):
+                return locs
+            time.sleep(max(0.0, min(attempt + delay - time.monotonic(), deadline - time.monotonic())))
+            delay = min(delay * WAIT_BACKOFF_FACTOR, Config.wait_backoff_max)
+            # endregion
+
+
+def _match(haystack, needle, threshold, mode, mask=None, shrink=None):
+    """
+    Template matches the needle against the haystack with the requested strategy.
+    :param haystack: The grayscale numpy array to search.
+    :param needle: The grayscale numpy array to look for.
+    :param threshold: The matching threshold to use.
+    :param mode: The MatchModes search strategy to use.
+    :param mask: Optional uint8 numpy array of the needle pixels to compare, transparent pixels are 0.
+    :param shrink: Optional function returning the haystack shrunk by an integer factor.
+    :return: numpy array of scores for every top left corner, -1 where the strategy did not evaluate the corner.
+    """
+    if mode == MatchModes.EXACT:
+        return _correlate(haystack, needle, mask)
+    elif mode == MatchModes.PYRAMID:
+        return _pyramid_match(haystack, needle, threshold, mask, shrink)
+    elif mode == MatchModes.TILED:
+        return _tiled_match(haystack, needle, mask)
+    raise SimpleRPAException("Unknown find_image mode '" + str(mode) + "'.")
+
+
+def _correlate(haystack, needle, mask=None):
+    """
+    Runs normalized correlation template matching. Masked matching yields NaN or infinity where the haystack is flat
+    under the mask, those corners are scored -1 so they never match.
+    :param haystack: The grayscale numpy array to search.
+    :param needle: The grayscale numpy array to look for.
+    :param mask: Optional uint8 numpy array of the needle pixels to compare.
+    :return: numpy array of scores for every top left corner.
+    """
+    if mask is None:
+        return cv2.matchTemplate(haystack, needle, cv2.TM_CCOEFF_NORMED)
+    res = cv2.matchTemplate(haystack, needle, cv2.TM_CCOEFF_NORMED, mask=mask)
+    return np.nan_to_num(res, copy=False, nan=-1.0, posinf=-1.0, neginf=-1.0)
+
+
+def _select(res, threshold, w, h, max_results, suppress):
+    """
+    Picks the matches out of a score map.
+    :param res: The numpy array of scores returned by _match.
+    :param threshold: The matching threshold to use.
+    :param w: The width of the needle.
+    :param h: The height of the needle.
+    :param max_results: Optional maximum number of matches to return.
+    :param suppress: If true overlapping matches are collapsed onto the best scoring one.
+    :return: tuple(x,y,score)[] ordered by descending score when suppressing or limiting, by position otherwise.
+    """
+    # region A single best match only needs the global maximum.
+    if max_results is not None and int(max_results) <= 0:
+        return list()
+    if max_results is not None and int(max_results) == 1:
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+        if max_val < threshold or not np.isfinite(max_val):
+            return list()
+        return [(int(max_loc[0]), int(max_loc[1]), float(max_val))]
+    # endregion
+
+    # region Collect every corner above the threshold.
+    if suppress:
+        # Only local maxima within a needle sized neighbourhood can survive suppression.
+        peaks = cv2.dilate(res, np.ones((h, w), dtype=np.uint8))
+        ys, xs = np.nonzero((res >= threshold) & (res >= peaks))
+    else:
+        ys, xs = np.nonzero(res >= threshold)
+    scores = res[ys, xs]
+    if not suppress and max_results is None:
+        return [(int(x), int(y), float(score)) for x, y, score in zip(xs, ys, scores)]
+    order = np.argsort(-scores, kind='stable')
+    ys, xs, scores = ys[order], xs[order], scores[order]
+    # endregion
+
+    # region Greedily keep the best match of every group of overlapping matches.
+    limit = len(scores) if max_results is None else int(max_results)
+    if not suppress:
+        return [(int(x), int(y), float(score)) for x, y, score in zip(xs[:limit], ys[:limit], scores[:limit])]
+    keep = list()
+    alive = np.ones(len(scores), dtype=bool)
+    area = float(w * h)
+    for i in range(len(scores)):
+        if not alive[i]:
+            continue
+        keep.append((int(xs[i]), int(ys[i]), float(scores[i])))
+        if len(keep) >= limit:
+            break
+        overlap = np.maximum(0, w - np.abs(xs - xs[i])) * np.maximum(0, h - np.abs(ys - ys[i]))
+        alive &= overlap / (2 * area - overlap) <= Config.match_overlap
+    return keep
+    # endregion
+
+
+def _detect_features(image, features):
+    """
+    Detects ORB keypoints and computes their descriptors.
+    :param image: The grayscale numpy array to describe.
+    :param features: The maximum number of keypoints to keep.
+    :return: tuple(keypoints, descriptors)
+    """
+    return _Needle_Cache.create_orb(features).detectAndCompute(image, None)
+
+
+def _feature_match(haystack, scene, needle, threshold):
+    """
+    Locates the needle by matching ORB descriptors and fitting a similarity transform (translation, rotation and
+    uniform scale), which covers the needle being drawn at a different DPI or zoom. The located area is warped back
+    onto the needle and scored with the same normalized correlation as the template modes, so the threshold means the
+    same thing.
+    :param haystack: The grayscale numpy array to search.
+    :param scene: The (keypoints, descriptors) of the haystack.
+    :param needle: The Needle to look for.
+    :param threshold: The matching threshold to use.
+    :return: tuple(x,y,w,h,score)[] with at most one location.
+    """
+    # region Pair descriptors that are clearly closer to each other than to the runner up.
+    points, descriptors = needle.features()
+    scene_keypoints, scene_descriptors = scene
+    if descriptors is None or scene_descriptors is None or len(descriptors) < 2 or len(scene_descriptors) < 2:
+        return list()
+    pairs = cv2.BFMatcher(cv2.NORM_HAMMING).knnMatch(descriptors, scene_descriptors, k=2)
+    good = [p[0] for p in pairs if len(p) == 2 and p[0].distance < Config.orb_ratio * p[1].distance]
+    if len(good) < max(3, int(Config.orb_min_matches)):
+        return list()
+    # endregion
+
+    # region Fit the similarity transform from the needle onto the screen.
+    src = np.float32([points[m.queryIdx] for m in good]).reshape(-1, 1, 2)
+    dst = np.float32([scene_keypoints[m.trainIdx].pt for m in good]).reshape(-1, 1, 2)
+    transform, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+    if transform is None or int(inliers.sum()) < max(3, int(Config.orb_min_matches)):
+        return list()
+    corners = np.float32([[0, 0], [needle.width, 0], [needle.width, needle.height], [0, needle.height]])
+    projected = cv2.transform(corners.reshape(-1, 1, 2), transform)
+    if cv2.contourArea(projected) < 1:
+        return list()
+    # endregion
+
+    # region Score the located area against the needle.
+    rectified = cv2.warpAffine(haystack, transform, (needle.width, needle.height),
+                               flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP)
+    score = float(_correlate(rectified, needle.image, needle.mask)[0][0])
+    if not score >= threshold:
+        return list()
+    left, top = np.rint(projected.min(axis=(0, 1))).astype(int)
+    right, bottom = np.rint(projected.max(axis=(0, 1))).astype(int)
+    x, y = max(0, int(left)), max(0, int(top))
+    w, h = min(int(right), haystack.shape[1]) - x, min(int(bottom), haystack.shape[0]) - y
+    return [(x, y, w, h, score)]
+    # endregion
+
+
+def _tiled_match(haystack, needle, mask=None):
+    """
+    Splits the haystack into horizontal tiles that overlap by the needle height and matches them on the worker pool.
+    OpenCV releases the GIL while matching so the tiles run on separate cores.
+    :param haystack: The grayscale numpy array to search.
+    :param needle: The grayscale numpy array to look for.
+    :param mask: Optional uint8 numpy array of the needle pixels to compare.
+    :return: numpy array of scores for every top left corner.
+    """
+    rows = haystack.shape[0] - needle.shape[0] + 1
+    workers = _Workers.worker_count()
+    step = max(-(-rows // workers), needle.shape[0])
+    if workers == 1 or step >= rows:
+        return _correlate(haystack, needle, mask)
+
+    res = np.empty((rows, haystack.shape[1] - needle.shape[1] + 1), dtype=np.float32)
+
+    def match_tile(y):
+        # Each tile extends by the needle height so corners near its bottom edge are still complete.
+        end = min(y + step, rows)
+        res[y:end] = _correlate(haystack[y:end + needle.shape[0] - 1], needle, mask)
+
+    _Workers.map_all(match_tile, list(range(0, rows, step)))
+    return res
+
+
+def _pyramid_match(haystack, needle, threshold, mask=None, shrink=None):
+    """
+    Coarse to fine template matching. The needle is matched against a downscaled copy of the haystack first and only
+    the neighbourhoods of candidate peaks are matched again at full resolution.
+    A downscaled needle only lines up with the downscaled haystack when its position is a multiple of the scale, so
+    the needle is downscaled at several phases (offsets modulo the scale) and each phase is matched. Phases are half a
+    coarse pixel apart, so some phase is always within a quarter of a coarse pixel of the grid, which keeps the coarse
+    score close to the full resolution one wherever the needle is.
+    :param haystack: The grayscale numpy array to search.
+    :param needle: The grayscale numpy array to look for.
+    :param threshold: The matching threshold to use at full resolution.
+    :param mask: Optional uint8 numpy array of the needle pixels to compare.
+    :param shrink: Optional function returning the haystack shrunk by an integer factor along with the (x, y) offset
+    of its grid, such as the memoized pyramid levels of a frame. Coarse pixel (X, Y) covers the haystack from
+    (X * scale - x, Y * scale - y). Defaults to shrinking the haystack itself.
+    :return: numpy array of scores for every top left corner, -1 where the corner was not refined.
+    """
+    if shrink is None:
+        shrink = lambda scale: (_downscale(haystack, scale), (0, 0))
+    shape = (haystack.shape[0] - needle.shape[0] + 1, haystack.shape[1] - needle.shape[1] + 1)
+    if shape[0] <= 0 or shape[1] <= 0:
+        return np.full((max(shape[0], 1), max(shape[1], 1)), -1, dtype=np.float32)
+
+    # region Use the coarsest level where every phase of the downscaled needle still has enough detail to match.
+    levels = sorted({int(lvl) for lvl in Config.pyramid_levels if int(lvl) > 1}, reverse=True)
+    levels = [lvl for lvl in levels if min(needle.shape[0], needle.shape[1]) // lvl - 1 >= PYRAMID_MIN_NEEDLE and
+              all(cv2.meanStdDev(ndl, mask=msk)[1][0][0] > 0
+                  for ndl, msk, py, px in _phases(needle, mask, lvl, max(1, lvl // 2)))]
+    if len(levels) == 0:
+        return _match(haystack, needle, threshold, MatchModes.EXACT, mask)
+    scale = levels[0]
+    # endregion
+
+    # region Match every phase of the needle at the coarse level and map the candidates to full resolution.
+    hay, (ox, oy) = shrink(scale)
+    seeds = np.zeros(shape, dtype=np.uint8)
+    step = max(1, scale // 2)
+    for ndl, msk, py, px in _phases(needle, mask, scale, step):
+        if hay.shape[0] < ndl.shape[0] or hay.shape[1] < ndl.shape[1]:
+            continue
+        ys, xs = np.nonzero(_correlate(hay, ndl, msk) >= threshold - Config.pyramid_tolerance)
+        ys, xs = ys * scale - oy - py, xs * scale - ox - px
+        keep = (ys >= 0) & (ys < shape[0]) & (xs >= 0) & (xs < shape[1])
+        seeds[ys[keep], xs[keep]] = 1
+    # endregion
+
+    # region Refine the grown candidate areas at full resolution.
+    reach = int(Config.pyramid_refine_window) + step - 1
+    seeds = cv2.dilate(seeds, np.ones((2 * reach + 1, 2 * reach + 1), dtype=np.uint8))
+    res = np.full(shape, -1, dtype=np.float32)
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(seeds, connectivity=8)
+    for i in range(1, count):
+        x, y, w, h = stats[i][:4]
+        roi = haystack[y:y + h + needle.shape[0] - 1, x:x + w + needle.shape[1] - 1]
+        patch = _correlate(roi, needle, mask)
+        np.maximum(res[y:y + h, x:x + w], patch, out=res[y:y + h, x:x + w])
+    # endregion
+
+    return res
+
+
+def _phases(needle, mask, scale, step):
+    """
+    Downscales the needle at every step-th offset modulo the scale. The needle of phase (py, px) starts py rows and px
+    columns into the original one, so it lines up with the coarse grid when the needle sits at a position congruent to
+    minus the phase. All phases are cropped to the same size.
+    :param needle: The grayscale numpy array to downscale.
+    :param mask: Optional uint8 numpy array of the needle pixels to compare.
+    :param scale: The integer factor to shrink by.
+    :param step: The distance between phases.
+    :return: tuple(needle, mask, py, px)[]
+    """
+    h, w = (needle.shape[0] - scale + 1) // scale * scale, (needle.shape[1] - scale + 1) // scale * scale
+    phases = list()
+    for py in range(0, scale, step):
+        for px in range(0, scale, step):
+            ndl = _downscale(needle[py:py + h, px:px + w], scale)
+            msk = None if mask is None else _downscale_mask(mask[py:py + h, px:px + w], scale)
+            phases.append((ndl, msk, py, px))
+    return phases
+
+
+def _downscale_mask(mask, scale):
+    """
+    Shrinks a needle mask by an integer factor. Only pixels whose whole block was opaque are kept, unless that would
+    leave nothing to compare.
+    :param mask: The uint8 numpy array to shrink or None.
+    :param scale: The integer factor to shrink by.
+    :return: numpy.array or None
+    """
+    if mask is None or scale == 1:
+        return mask
+    small = _downscale(mask, scale)
+    if cv2.countNonZero(np.where(small == 255, 255, 0).astype(np.uint8)) > 0:
+        return np.where(small == 255, 255, 0).astype(np.uint8)
+    return np.where(small > 0, 255, 0).astype(np.uint8)
+
+
+def _downscale(image, scale):
+    """
+    Shrinks an image by an integer factor.
+    :param image: The numpy array to shrink.
+    :param scale: The factor to shrink by.
+    :return: numpy.array
+    """
+    if scale == 1:
+        return image
+    return cv2.resize(image, (max(1, image.shape[1] // scale), max(1, image.shape[0] // scale)),
+                      interpolation=cv2.INTER_AREA)
+
+
+def _search_bbox(region, monitor=None):
+    """
+    Converts an optional search region into a bounding box clipped to the screen, or to the monitor if one is given.
+    :param region: Tuple area rectangle (x, y, w, h) or None for the whole screen or monitor.
+    :param monitor: Optional index or name of the monitor the region is relative to.
+    :return: tuple(left, top, right, bottom)
+    """
+    width, height = _Capture_Convergence.screen_size()
+    bounds = _clip_bbox((0, 0, width, height), _monitor_bounds(monitor))
+    if region is None:
+        return bounds
+    x, y = _on_monitor((int(region[0]), int(region[1])), monitor)
+    return _clip_bbox((x, y, x + int(region[2]), y + int(region[3])), bounds)
+
+
+def get_monitors():
+    """
+    Returns the monitors of the desktop.
+    :return: Monitor[]
+    """
+    return _Capture_Convergence.monitors()
+
+
+def register_region(name, rct, anchor=None, threshold=0.9, search=None, monitor=None):
+    """
+    Registers a named region that protocol methods can use in place of a rectangle.
+    :param name: The name of the region.
+    :param rct: Tuple area rectangle (x, y, w, h) relative to the anchor, the monitor or the desktop.
+    :param anchor: Optional name of the image file the region is anchored to.
+    :param threshold: The matching threshold used to find the anchor.
+    :param search: Optional tuple area rectangle (x, y, w, h) the anchor is searched in.
+    :param monitor: Optional index or name of the monitor the region or anchor search is relative to.
+    :return: void
+    """
+    _Region_Registry.regions.register(_Region_Registry.NamedRegion(name, rct[0], rct[1], rct[2], rct[3], anchor,
+                                                                   threshold, search, monitor))
+
+
+def unregister_region(name):
+    """
+    Removes a named region.
+    :param name: The name of the region.
+    :return: bool True if the region existed.
+    """
+    return _Region_Registry.regions.unregister(name)
+
+
+def get_regions():
+    """
+    Returns the names of the registered regions.
+    :return: str[]
+    """
+    return _Region_Registry.regions.names()
+
+
+def resolve_region(name):
+    """
+    Returns the desktop area of a named region. The anchor of the region is searched for at most once per input
+    generation, later calls reuse where it was found.
+    :param name: The name of the region.
+    :return: tuple(x, y, w, h)
+    """
+    region, rct, generation = _Region_Registry.regions.get(name)
+    if rct is not None:
+        return rct
+    if region.anchor is None:
+        x, y = _on_monitor((region.x, region.y), region.monitor)
+    else:
+        locs = find_image(region.anchor, region.threshold, False, 0, region.search, best_only=True,
+                          monitor=region.monitor)
+        if len(locs) == 0:
+            raise SimpleRPAException("The anchor of region '" + str(name) + "' was not found.")
+        x, y = locs[0][0] + region.x, locs[0][1] + region.y
+    rct = (x, y, region.width, region.height)
+    _Region_Registry.regions.store(name, generation, rct)
+    return rct
+
+
+def _on_monitor(pt, monitor):
+    """
+    Maps a point relative to a monitor to desktop coordinates.
+    :param pt: The point to map.
+    :param monitor: The index or name of the monitor, or None for desktop coordinates.
+    :return: tuple(x, y)
+    """
+    m = _Capture_Convergence.get_monitor(monitor)
+    if m is None:
+        return pt
+    return pt[0] + m.x, pt[1] + m.y
+
+
+def _monitor_bounds(monitor):
+    """
+    Returns the area of the desktop a monitor shows.
+    :param monitor: The index or name of the monitor, or None for the whole desktop.
+    :return: tuple(left, top, right, bottom) or None
+    """
+    m = _Capture_Convergence.get_monitor(monitor)
+    return None if m is None else m.bbox
+
+
+def _monitor_bbox(rct, monitor):
+    """
+    Maps a bounding box relative to a monitor to desktop coordinates, clipped to that monitor.
+    :param rct: The (left, top, right, bottom) tuple to map, or None for the whole monitor.
+    :param monitor: The index or name of the monitor, or None for desktop coordinates.
+    :return: tuple(left, top, right, bottom)
+    """
+    bounds = _monitor_bounds(monitor)
+    if bounds is None:
+        return rct
+    if rct is None:
+        return bounds
+    return _clip_bbox((rct[0] + bounds[0], rct[1] + bounds[1], rct[2] + bounds[0], rct[3] + bounds[1]), bounds)
+
+
+def _clip_bbox(bbox, bounds):
+    """
+    Clips a bounding box to another, the result is empty rather than inverted if they do not overlap.
+    :param bbox: The (left, top, right, bottom) tuple to clip.
+    :param bounds: The (left, top, right, bottom) tuple to clip to, or None to leave the box unchanged.
+    :return: tuple(left, top, right, bottom)
+    """
+    if bounds is None:
+        return tuple(bbox)
+    left = min(max(bounds[0], bbox[0]), bounds[2])
+    top = min(max(bounds[1], bbox[1]), bounds[3])
+    return left, top, max(left, min(bounds[2], bbox[2])), max(top, min(bounds[3], bbox[3]))
+
+
+def get_cache_stats():
+    """
+    Returns the hit and miss counters of the screen caches.
+    :return: dict
+    """
+    return {"needle_cache": _Needle_Cache.needles.stats(), "capture_buffers": _Capture_Convergence.buffers.stats(),
+            "location_hints": _Location_Hints.hints.stats(), "tile_index": _Tile_Index.index.stats(),
+            "result_cache": _Tile_Index.results.stats(), "regions": _Region_Registry.regions.stats(),
+            "element_maps": _Element_Map.maps.stats()}
 
 
 class Color:
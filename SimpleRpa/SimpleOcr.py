@@ -24,9 +24,11 @@ import sys
 import cv2
 import json
 import numpy as np
+import _Capture_Convergence
+import _Tile_Index
+import _Workers
 from _Platform_Convergence import Config
 from _Widget import Widget
-from PIL import ImageGrab
 
 maps = list()
 
@@ -74,43 +76,61 @@ def add_font(path):
     # endregion
 
 
-def perform_ocr(fontmaps, rect, ocr_threshold, capture_threshold, use_widget=None, duration=0):
+def perform_ocr(fontmaps, rect, ocr_threshold, capture_threshold, use_widget=None, duration=0, monitor=None):
     """
     Captures the screen at the specified rect and perform quick ocr using specified font maps.
     :param fontmaps: The list of fontmaps to look for.
     :param rect: Rectangular tuple area of the screen to capture.
     :param ocr_threshold: The matching threshold to use.
     :param capture_threshold: The threshold to use when reducing image to monochrome.
+    :param monitor: Optional index or name of the monitor the rect is relative to.
     :return: str
     """
-    image = __capture(rect, capture_threshold)
-    chars = __get_chars(image, fontmaps, ocr_threshold)
+    m = _Capture_Convergence.get_monitor(monitor)
+    if m is not None:
+        rect = (rect[0] + m.x, rect[1] + m.y, rect[2], rect[3])
     if use_widget is None:
         use_widget = Config.use_widgets_by_default
         if duration == 0:
             duration = Config.default_widget_duration
     if use_widget:
         Widget._show_widget_rect(rect, duration)
-    if len(chars) == 0:
-        return '';
-    data = __sort_chars(chars)
-    text = __get_text(data)
+
+    # region Answer from the result cache while the tiles under the rect are unchanged.
+    hashes = None
+    pixels = None
+    if Config.result_cache:
+        pixels, hashes = _Tile_Index.grab((rect[0], rect[1], rect[0] + rect[2], rect[1] + rect[3]))
+        names = tuple(fontmaps) if isinstance(fontmaps, list) else fontmaps
+        key = ('ocr', names, tuple(m.name for m in maps), ocr_threshold, capture_threshold, tuple(rect))
+        found, text = _Tile_Index.results.get(key, hashes)
+        if found:
+            return text
+    # endregion
+
+    image = __capture(rect, capture_threshold, pixels)
+    chars = __get_chars(image, fontmaps, ocr_threshold)
+    text = ''
+    if len(chars) > 0:
+        data = __sort_chars(chars)
+        text = __get_text(data)
+    if hashes is not None:
+        _Tile_Index.results.put(key, hashes, text)
     return text
 
 
 # TODO: Is this the same as screen?
-def __capture(rect, threshold):
+def __capture(rect, threshold, image=None):
     """
     Captures the specified area of the screen.
     :param rect: The rectangular tuple area of the screen to grab.
     :param threshold: The matching threshold to use.
+    :param image: Optional pixels of the rect when they have already been captured.
     :return: Image
     """
     # region Get screen print and reduce to mnochrome
-    bitmap = ImageGrab.grab(bbox=(rect[0], rect[1], rect[0] + rect[2], rect[1] + rect[3]), all_screens=True)
-    image = np.array(bitmap)
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    image = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY)[1]
+    bbox = (rect[0], rect[1], rect[0] + rect[2], rect[1] + rect[3])
+    image = _Capture_Convergence.frame_for(bbox, image).binarized(threshold, bbox)
     # endregion
 
     # region Check to see if image needs inverted if so do it.
@@ -138,6 +158,8 @@ def __get_chars(image, fontmaps, threshold):
         fontmaps = list()
         fontmaps.append(fm)
     # endregion
+    # region Collect the glyphs of every requested font map.
+    glyphs = list()
     l0 = len(maps)
     l1 = len(fontmaps)
     for m in range(l0):
@@ -145,18 +167,26 @@ def __get_chars(image, fontmaps, threshold):
             if maps[m].name == fontmaps[f]:
                 l3 = len(maps[m].image)
                 for i in range(l3):
-                    bmp = maps[m].image[i]
-                    res = cv2.matchTemplate(image, bmp, cv2.TM_CCOEFF_NORMED)
-                    loc = np.where(res >= threshold)
-                    for pt in zip(*loc[::-1]):
-                        char = Character()
-                        char.left = pt[0]
-                        char.top = pt[1]
-                        char.width = bmp.shape[1]
-                        char.height = bmp.shape[0]
-                        char.char = maps[m].character[i]
-                        chars.append(char)
+                    glyphs.append((maps[m].image[i], maps[m].character[i]))
+    # endregion
+
+    # region Match the glyphs on the worker pool and collect the characters in glyph order.
+    def match_glyph(glyph):
+        res = cv2.matchTemplate(image, glyph[0], cv2.TM_CCOEFF_NORMED)
+        return np.where(res >= threshold)
+
+    locs = _Workers.map_all(match_glyph, glyphs)
+    for (bmp, character), loc in zip(glyphs, locs):
+        for pt in zip(*loc[::-1]):
+            char = Character()
+            char.left = pt[0]
+            char.top = pt[1]
+            char.width = bmp.shape[1]
+            char.height = bmp.shape[0]
+            char.char = character
+            chars.append(char)
     return chars
+    # endregion
 
 
 def __sort_chars(chars):
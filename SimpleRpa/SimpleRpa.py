@@ -24,6 +24,7 @@ import sys
 import json
 import os.path
 import _Web_Comm
+import _Flight_Recorder
 from _Platform_Convergence import Config
 from Keyboard import Console
 from colorama import Fore
@@ -96,6 +97,198 @@ def configure():
     Config.maximum_port = config["maximum_port"]
     Config.server = config["server"]
     Config.port = config["minimum_port"]
+    try:
+        Config.capture_backend = config['capture_backend']
+    except:
+        do_nothing = True
+    try:
+        Config.frame_history = config['frame_history']
+    except:
+        do_nothing = True
+    try:
+        Config.change_detection = config['change_detection']
+    except:
+        do_nothing = True
+    try:
+        Config.change_poll_interval = config['change_poll_interval']
+    except:
+        do_nothing = True
+    try:
+        Config.needle_cache_entries = config['needle_cache_entries']
+    except:
+        do_nothing = True
+    try:
+        Config.needle_cache_bytes = config['needle_cache_bytes']
+    except:
+        do_nothing = True
+    try:
+        Config.pyramid_levels = config['pyramid_levels']
+    except:
+        do_nothing = True
+    try:
+        Config.pyramid_refine_window = config['pyramid_refine_window']
+    except:
+        do_nothing = True
+    try:
+        Config.pyramid_tolerance = config['pyramid_tolerance']
+    except:
+        do_nothing = True
+    try:
+        Config.suppress_overlapping_matches = config['suppress_overlapping_matches']
+    except:
+        do_nothing = True
+    try:
+        Config.match_overlap = config['match_overlap']
+    except:
+        do_nothing = True
+    try:
+        Config.worker_threads = config['worker_threads']
+    except:
+        do_nothing = True
+    try:
+        Config.wait_backoff_min = config['wait_backoff_min']
+    except:
+        do_nothing = True
+    try:
+        Config.wait_backoff_max = config['wait_backoff_max']
+    except:
+        do_nothing = True
+    try:
+        Config.stream_tile_size = config['stream_tile_size']
+    except:
+        do_nothing = True
+    try:
+        Config.stream_keyframe_interval = config['stream_keyframe_interval']
+    except:
+        do_nothing = True
+    try:
+        Config.stream_history = config['stream_history']
+    except:
+        do_nothing = True
+    try:
+        Config.capture_buffers = config['capture_buffers']
+    except:
+        do_nothing = True
+    try:
+        Config.recorder_enabled = config['recorder_enabled']
+    except:
+        do_nothing = True
+    try:
+        Config.recorder_fps = config['recorder_fps']
+    except:
+        do_nothing = True
+    try:
+        Config.recorder_quality = config['recorder_quality']
+    except:
+        do_nothing = True
+    try:
+        Config.recorder_bytes = config['recorder_bytes']
+    except:
+        do_nothing = True
+    try:
+        Config.recorder_folder = config['recorder_folder']
+    except:
+        do_nothing = True
+    try:
+        Config.recorder_dump_on_exception = config['recorder_dump_on_exception']
+    except:
+        do_nothing = True
+    try:
+        Config.recorder_dump_interval = config['recorder_dump_interval']
+    except:
+        do_nothing = True
+    try:
+        Config.orb_needle_features = config['orb_needle_features']
+    except:
+        do_nothing = True
+    try:
+        Config.orb_scene_features = config['orb_scene_features']
+    except:
+        do_nothing = True
+    try:
+        Config.orb_ratio = config['orb_ratio']
+    except:
+        do_nothing = True
+    try:
+        Config.orb_min_matches = config['orb_min_matches']
+    except:
+        do_nothing = True
+    try:
+        Config.location_hints = config['location_hints']
+    except:
+        do_nothing = True
+    try:
+        Config.hint_locations = config['hint_locations']
+    except:
+        do_nothing = True
+    try:
+        Config.hint_margin = config['hint_margin']
+    except:
+        do_nothing = True
+    try:
+        Config.hint_entries = config['hint_entries']
+    except:
+        do_nothing = True
+    try:
+        Config.result_cache = config['result_cache']
+    except:
+        do_nothing = True
+    try:
+        Config.result_cache_entries = config['result_cache_entries']
+    except:
+        do_nothing = True
+    try:
+        Config.tile_index_size = config['tile_index_size']
+    except:
+        do_nothing = True
+    try:
+        Config.regions = config['regions']
+    except:
+        do_nothing = True
+    try:
+        Config.element_min_size = config['element_min_size']
+    except:
+        do_nothing = True
+    try:
+        Config.element_map_entries = config['element_map_entries']
+    except:
+        do_nothing = True
+    try:
+        Config.diff_threshold = config['diff_threshold']
+    except:
+        do_nothing = True
+    try:
+        Config.diff_merge_distance = config['diff_merge_distance']
+    except:
+        do_nothing = True
+    try:
+        Config.video_fps = config['video_fps']
+    except:
+        do_nothing = True
+    try:
+        Config.video_queue_frames = config['video_queue_frames']
+    except:
+        do_nothing = True
+    try:
+        Config.video_encoder = config['video_encoder']
+    except:
+        do_nothing = True
+    try:
+        Config.video_ffmpeg = config['video_ffmpeg']
+    except:
+        do_nothing = True
+    try:
+        Config.video_fourcc = config['video_fourcc']
+    except:
+        do_nothing = True
+    try:
+        Config.video_extension = config['video_extension']
+    except:
+        do_nothing = True
+    try:
+        Config.video_folder = config['video_folder']
+    except:
+        do_nothing = True
     # endregion
 
     # region Load settings from command line.
@@ -147,6 +340,9 @@ def warn(prop):
 if __name__ == '__main__':
     configure()
 
+    if Config.recorder_enabled:
+        _Flight_Recorder.start()
+
     if Config.protocol == "WebService":
         _Web_Comm.run(Config.port, Config.key, Config.iv, Config.verbose_level)
     elif Config.protocol == "Win32Pipe":
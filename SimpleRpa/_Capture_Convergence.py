@@ -0,0 +1,710 @@
+﻿# region License
+"""
+ * SimplRPA - A simple RPA library for Python and C#
+ *
+ * Copyright (c) 2009-2021 Ziglag the Orc
+ * Modifications (c) as per Git change history
+ *
+ * This Source Code Form is subject to the terms of the Mozilla
+ * Public License, v. 2.0. If a copy of the MPL was not distributed
+ * with this file, You can obtain one at
+ * https://mozilla.org/MPL/2.0/.
+ *
+ * The above copyright notice and this permission notice shall be included in all copies or substantial
+ * portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+ * LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ * IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+ * WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# endregion
+import sys
+import time
+import zlib
+import itertools
+import threading
+import collections
+import cv2
+import numpy as np
+import _Platform_Convergence as pc
+from contextlib import contextmanager
+from _Platform_Convergence import Config, SimpleRPAException
+from PIL import Image, ImageGrab
+
+if sys.platform.startswith('linux'):
+    import _Capture_Linux
+
+BACKENDS = ('auto', 'xshm', 'xlib', 'pil')
+FALLBACKS = {'xshm': 'xlib', 'xlib': 'pil'}
+CHANGE_DETECTORS = ('auto', 'damage', 'poll')
+
+_grabber = None
+_lock = threading.Lock()
+_frame_ids = itertools.count(1)
+_last_frame = None
+_frames = collections.OrderedDict()
+_frames_lock = threading.Lock()
+_state = threading.local()
+_tracker = None
+_geometry = None
+_monitors = None
+_randr = None
+
+
+class Frame:
+    """
+    A capture of the whole desktop that several screen queries can share.
+    """
+    def __init__(self, frame_id, generation, bbox, pixels):
+        """
+        Constructs a new Frame instance.
+        :param frame_id: The unique id of this capture.
+        :param generation: The input generation the capture was taken in.
+        :param bbox: The (left, top, right, bottom) area of the desktop the pixels cover.
+        :param pixels: The RGB numpy array of the capture.
+        """
+        pixels.flags.writeable = False
+        self.frame_id = frame_id
+        self.generation = generation
+        self.bbox = bbox
+        self.pixels = pixels
+        self._derived = dict()
+        self._derived_lock = threading.Lock()
+
+    def is_current(self):
+        """
+        Returns True if no input has been injected since this frame was captured.
+        :return: bool
+        """
+        return self.generation == pc.input_generation
+
+    def contains(self, bbox):
+        """
+        Returns True if the specified area lies completely inside this frame.
+        :param bbox: The (left, top, right, bottom) tuple to check.
+        :return: bool
+        """
+        return self.bbox[0] <= bbox[0] and self.bbox[1] <= bbox[1] and bbox[2] <= self.bbox[2] and \
+            bbox[3] <= self.bbox[3]
+
+    def crop(self, bbox):
+        """
+        Returns a read only view of the specified area of this frame.
+        :param bbox: The (left, top, right, bottom) tuple to return.
+        :return: numpy.array
+        """
+        return self.pixels[bbox[1] - self.bbox[1]:bbox[3] - self.bbox[1], bbox[0] - self.bbox[0]:bbox[2] - self.bbox[0]]
+
+    def gray(self, bbox=None):
+        """
+        Returns a read only grayscale view of the specified area of this frame. The conversion runs once per frame.
+        :param bbox: Optional (left, top, right, bottom) tuple to return, defaults to the whole frame.
+        :return: numpy.array
+        """
+        image = self._derive(('gray',), lambda: cv2.cvtColor(self.pixels, cv2.COLOR_BGR2GRAY))
+        return self._crop(image, bbox, 1)
+
+    def binarized(self, threshold, bbox=None):
+        """
+        Returns a read only monochrome view of the specified area of this frame. The conversion runs once per frame
+        and threshold.
+        :param threshold: The gray level above which pixels become white.
+        :param bbox: Optional (left, top, right, bottom) tuple to return, defaults to the whole frame.
+        :return: numpy.array
+        """
+        image = self._derive(('binary', threshold),
+                             lambda: cv2.threshold(self.gray(), threshold, 255, cv2.THRESH_BINARY)[1])
+        return self._crop(image, bbox, 1)
+
+    def level(self, scale, bbox=None):
+        """
+        Returns a read only view of the grayscale frame shrunk by an integer factor. Each pyramid level is computed
+        once per frame. The view starts at the level pixel containing the top left corner of the area, so it may be
+        offset from the area by less than one level pixel.
+        :param scale: The integer factor to shrink by.
+        :param bbox: Optional (left, top, right, bottom) tuple to return, defaults to the whole frame.
+        :return: numpy.array
+        """
+        if scale == 1:
+            return self.gray(bbox)
+        image = self._derive(('level', scale), lambda: cv2.resize(
+            self.gray(), (max(1, self.pixels.shape[1] // scale), max(1, self.pixels.shape[0] // scale)),
+            interpolation=cv2.INTER_AREA))
+        return self._crop(image, bbox, scale)
+
+    def invalidate(self):
+        """
+        Drops the derived representations of this frame. They are computed again if the frame is used afterwards.
+        :return: void
+        """
+        with self._derived_lock:
+            self._derived.clear()
+
+    def _derive(self, key, compute):
+        """
+        Returns a memoized representation of this frame, computing it on first use.
+        :param key: The hashable name of the representation.
+        :param compute: The function computing the representation.
+        :return: numpy.array
+        """
+        with self._derived_lock:
+            image = self._derived.get(key)
+        if image is None:
+            image = compute()
+            image.flags.writeable = False
+            with self._derived_lock:
+                image = self._derived.setdefault(key, image)
+        return image
+
+    def _crop(self, image, bbox, scale):
+        """
+        Returns the part of a derived representation covering the specified area.
+        :param image: The representation of the whole frame.
+        :param bbox: The (left, top, right, bottom) tuple to return or None for all of it.
+        :param scale: The factor the representation is shrunk by.
+        :return: numpy.array
+        """
+        if bbox is None:
+            return image
+        left, top = (bbox[0] - self.bbox[0]) // scale, (bbox[1] - self.bbox[1]) // scale
+        width, height = max(1, (bbox[2] - bbox[0]) // scale), max(1, (bbox[3] - bbox[1]) // scale)
+        return image[top:top + height, left:left + width]
+
+
+class BufferPool:
+    """
+    Keeps the arrays captures are written into so repeated grabs of the same size reuse their memory. A buffer is
+    only reused once nothing but the pool references it, so views handed out stay valid for as long as they are
+    held, including the pixels of frozen frames.
+    """
+    def __init__(self):
+        """
+        Constructs a new BufferPool instance.
+        """
+        self._buffers = list()
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.allocated = 0
+
+    def acquire(self, shape):
+        """
+        Returns an unused buffer of the specified shape, allocating one if none is free.
+        :param shape: The (height, width, 3) shape of the buffer.
+        :return: numpy.array
+        """
+        with self._lock:
+            for i in range(len(self._buffers)):
+                # The pool list, the indexing temporary and getrefcount itself are the only references of a free
+                # buffer.
+                if self._buffers[i].shape == shape and sys.getrefcount(self._buffers[i]) <= 2:
+                    self._buffers.append(self._buffers.pop(i))
+                    self.reused += 1
+                    return self._buffers[-1]
+            buffer = np.empty(shape, dtype=np.uint8)
+            self._buffers.append(buffer)
+            self.allocated += 1
+            while len(self._buffers) > max(1, int(Config.capture_buffers)):
+                self._buffers.pop(0)
+            return buffer
+
+    def stats(self):
+        """
+        Returns the pool counters.
+        :return: dict
+        """
+        with self._lock:
+            return {"buffers": len(self._buffers), "bytes": sum(b.nbytes for b in self._buffers),
+                    "reused": self.reused, "allocated": self.allocated}
+
+
+buffers = BufferPool()
+
+
+def _read_only(buffer):
+    """
+    Returns a read only view of a pooled buffer.
+    :param buffer: The numpy array to wrap.
+    :return: numpy.array
+    """
+    view = buffer.view()
+    view.flags.writeable = False
+    return view
+
+
+class PilGrabber:
+    """
+    Grabs the screen with PIL.ImageGrab. This works on every platform and is the fallback for all other backends.
+    """
+    name = 'pil'
+
+    def size(self):
+        """
+        Returns the width and height of the primary screen.
+        :return: tuple(width, height)
+        """
+        return tuple(pc.size())
+
+    def grab(self, bbox, out=None):
+        """
+        Captures the specified area of the screen.
+        :param bbox: The (left, top, right, bottom) tuple to capture.
+        :param out: Optional preallocated (height, width, 3) uint8 array to write the pixels into.
+        :return: numpy.array
+        """
+        pixels = np.asarray(ImageGrab.grab(bbox=bbox, all_screens=True).convert('RGB'))
+        if out is None:
+            return pixels.copy()
+        out[...] = pixels
+        return out
+
+    def close(self):
+        """
+        Releases the grabber.
+        :return: void
+        """
+        return
+
+
+def _create_grabber(backend):
+    """
+    Creates the grabber for the requested backend, falling back along xshm -> xlib -> pil when a backend is not
+    available on this machine.
+    :param backend: One of 'auto', 'xshm', 'xlib' or 'pil'.
+    :return: Grabber
+    """
+    backend = str(backend).lower()
+    if backend not in BACKENDS:
+        raise SimpleRPAException("capture_backend must be one of " + str(BACKENDS) + " (received '" + backend + "').")
+
+    if sys.platform.startswith('linux'):
+        if backend in ('auto', 'xshm'):
+            try:
+                return _Capture_Linux.XShmGrabber()
+            except Exception:
+                backend = 'xlib'
+        if backend == 'xlib':
+            return _Capture_Linux.XlibGrabber()
+    return PilGrabber()
+
+
+def get_grabber():
+    """
+    Returns the long lived grabber for the configured backend, creating it on first use. If Config.capture_backend
+    has changed since the grabber was created it is replaced.
+    :return: Grabber
+    """
+    global _grabber
+    with _lock:
+        if _grabber is None or _grabber.requested != Config.capture_backend:
+            if _grabber is not None:
+                _grabber.close()
+            _grabber = _create_grabber(Config.capture_backend)
+            _grabber.requested = Config.capture_backend
+        return _grabber
+
+
+def _grab(bbox, out=None):
+    """
+    Grabs an area with the current grabber. A grabber that fails at runtime is replaced by the next backend along
+    xshm -> xlib -> pil and the grab is retried.
+    :param bbox: The (left, top, right, bottom) tuple to capture.
+    :param out: Optional preallocated (height, width, 3) uint8 array to write the pixels into.
+    :return: numpy.array
+    """
+    while True:
+        grabber = get_grabber()
+        try:
+            return grabber.grab(bbox, out)
+        except Exception:
+            if not _fall_back(grabber):
+                raise
+
+
+def _fall_back(grabber):
+    """
+    Replaces a failing grabber with the next backend.
+    :param grabber: The grabber that failed.
+    :return: bool False if there is no backend left to fall back to.
+    """
+    global _grabber
+    with _lock:
+        if _grabber is not grabber:
+            # Another thread has already replaced it.
+            return True
+        backend = FALLBACKS.get(grabber.name)
+        if backend is None:
+            return False
+        try:
+            grabber.close()
+        except Exception:
+            pass
+        _grabber = _create_grabber(backend)
+        _grabber.requested = grabber.requested
+        return True
+
+
+class Monitor:
+    """
+    A physical monitor and the area of the desktop it shows.
+    """
+    def __init__(self, index, name, x, y, width, height, primary):
+        """
+        Constructs a new Monitor instance.
+        :param index: The position of the monitor in the monitor list.
+        :param name: The name of the output driving the monitor.
+        :param x: The left edge of the monitor on the desktop.
+        :param y: The top edge of the monitor on the desktop.
+        :param width: The width of the monitor.
+        :param height: The height of the monitor.
+        :param primary: True if this is the primary monitor.
+        """
+        self.index = index
+        self.name = name
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.primary = primary
+
+    @property
+    def bbox(self):
+        """
+        The (left, top, right, bottom) area of the desktop the monitor shows.
+        :return: tuple(left, top, right, bottom)
+        """
+        return self.x, self.y, self.x + self.width, self.y + self.height
+
+
+def _set_geometry(size, monitors=None):
+    """
+    Stores the desktop size and monitor layout reported by the RandR monitor.
+    :param size: The new (width, height) of the desktop.
+    :param monitors: The new list of (name, x, y, width, height, primary) tuples.
+    :return: void
+    """
+    global _geometry, _monitors
+    _geometry = tuple(size)
+    if monitors is not None:
+        _monitors = [Monitor(i, *m) for i, m in enumerate(monitors)]
+
+
+def screen_size():
+    """
+    Returns the width and height of the desktop. On Linux the size is cached and refreshed by RandR screen change
+    events, elsewhere it is read from the platform module.
+    :return: tuple(width, height)
+    """
+    global _randr
+    if not sys.platform.startswith('linux'):
+        return tuple(pc.size())
+    with _lock:
+        if _randr is None:
+            try:
+                monitor = _Capture_Linux.RandrMonitor(_set_geometry)
+            except Exception:
+                _randr = False
+            else:
+                _set_geometry(monitor.size(), monitor.monitors())
+                monitor.start()
+                _randr = monitor
+    if _randr is False:
+        return tuple(get_grabber().size())
+    return _geometry
+
+
+def monitors():
+    """
+    Returns the monitors of the desktop. On Linux they are enumerated with RandR and refreshed by screen change
+    events, elsewhere and without RandR the whole desktop is reported as a single primary monitor.
+    :return: Monitor[]
+    """
+    width, height = screen_size()
+    if _monitors:
+        return list(_monitors)
+    return [Monitor(0, 'default', 0, 0, width, height, True)]
+
+
+def get_monitor(monitor):
+    """
+    Looks up a monitor by index or by name.
+    :param monitor: The index or name of the monitor, or None.
+    :return: Monitor or None
+    """
+    if monitor is None:
+        return None
+    lst = monitors()
+    for m in lst:
+        if m.name == monitor:
+            return m
+    try:
+        index = int(monitor)
+    except (TypeError, ValueError):
+        index = -1
+    if index < 0 or index >= len(lst):
+        raise SimpleRPAException("Unknown monitor '" + str(monitor) + "'.")
+    return lst[index]
+
+
+def capture_frame():
+    """
+    Captures the whole desktop into a new Frame.
+    :return: Frame
+    """
+    global _last_frame
+    generation = pc.input_generation
+    width, height = screen_size()
+    bbox = (0, 0, width, height)
+    pixels = _grab(bbox, buffers.acquire((height, width, 3)))
+    frame = Frame(next(_frame_ids), generation, bbox, _read_only(pixels))
+
+    # region Keep the recent frames of this input generation so clients can return to them by id.
+    with _frames_lock:
+        for frame_id in list(_frames):
+            if not _frames[frame_id].is_current():
+                _frames.pop(frame_id).invalidate()
+        _frames[frame.frame_id] = frame
+        while len(_frames) > max(1, int(Config.frame_history)):
+            _frames.popitem(last=False)[1].invalidate()
+        _last_frame = frame
+    # endregion
+    return frame
+
+
+def get_frame(frame_id):
+    """
+    Returns a recently captured frame by id if no input has been injected since it was captured.
+    :param frame_id: The id of the frame.
+    :return: Frame or None
+    """
+    with _frames_lock:
+        frame = _frames.get(frame_id)
+    if frame is None or not frame.is_current():
+        return None
+    return frame
+
+
+def last_frame():
+    """
+    Returns the most recent frame captured by capture_frame.
+    :return: Frame or None
+    """
+    return _last_frame
+
+
+def current_frame():
+    """
+    Returns the frame the calling thread is frozen on, or None if it is not inside a frozen() block.
+    :return: Frame
+    """
+    return getattr(_state, 'frame', None)
+
+
+@contextmanager
+def frozen(frame_id=None):
+    """
+    Freezes the screen for the duration of the block so every capture, color and search inside it reads the same
+    frame. Nested blocks share the outer frame.
+    :param frame_id: The id of a previously frozen frame to reuse. It is only reused while no input has been injected
+    since it was captured and it is still one of the Config.frame_history most recent frames, otherwise a fresh frame
+    is captured.
+    :return: The id of the frame in use.
+    """
+    outer = current_frame()
+    if outer is not None and (frame_id is None or frame_id == outer.frame_id):
+        frame = outer
+    else:
+        frame = get_frame(frame_id) if frame_id is not None else None
+        if frame is None:
+            frame = capture_frame()
+    _state.frame = frame
+    try:
+        yield frame.frame_id
+    finally:
+        _state.frame = outer
+
+
+@contextmanager
+def thawed():
+    """
+    Reads the live screen for the duration of the block even inside a frozen() block, for callers that wait for the
+    screen to change.
+    :return: contextmanager
+    """
+    outer = current_frame()
+    _state.frame = None
+    try:
+        yield
+    finally:
+        _state.frame = outer
+
+
+def grab(bbox):
+    """
+    Captures the specified area of the screen as a read only RGB array. The pixels are written into a pooled buffer
+    that is reused once the returned view is released. Inside a frozen() block the area is read from the frozen frame
+    instead of the screen, and the frame is recaptured if input was injected since it was taken.
+    :param bbox: The (left, top, right, bottom) tuple to capture.
+    :return: numpy.array
+    """
+    bbox = tuple(int(v) for v in bbox[:4])
+    frame = current_frame()
+    if frame is not None and not frame.is_current():
+        frame = capture_frame()
+        _state.frame = frame
+    if frame is not None and frame.contains(bbox):
+        return frame.crop(bbox)
+    return _read_only(_grab(bbox, buffers.acquire((bbox[3] - bbox[1], bbox[2] - bbox[0], 3))))
+
+
+def frame_for(bbox, pixels=None):
+    """
+    Returns a Frame covering the specified area so several conversions of the same pixels are shared. Inside a frozen()
+    block this is the frozen frame, otherwise the area is wrapped in a frame of its own.
+    :param bbox: The (left, top, right, bottom) tuple the frame must cover.
+    :param pixels: Optional pixels of the area when they have already been captured.
+    :return: Frame
+    """
+    bbox = tuple(int(v) for v in bbox[:4])
+    if pixels is None:
+        pixels = grab(bbox)
+    frame = current_frame()
+    if frame is not None and frame.is_current() and frame.contains(bbox):
+        return frame
+    return Frame(next(_frame_ids), pc.input_generation, bbox, pixels)
+
+
+def grab_image(bbox):
+    """
+    Captures the specified area of the screen as an RGB PIL image.
+    :param bbox: The (left, top, right, bottom) tuple to capture.
+    :return: Image
+    """
+    return Image.fromarray(grab(bbox), 'RGB')
+
+
+class ChangeTracker:
+    """
+    Keeps the most recent dirty rectangles of the screen reported by a damage monitor and lets callers block until
+    an area of interest is repainted.
+    """
+    def __init__(self, history=4096):
+        """
+        Constructs a new ChangeTracker instance.
+        :param history: The number of dirty rectangles to remember.
+        """
+        self.sequence = 0
+        self._dirty = collections.deque(maxlen=history)
+        self._changed = threading.Condition()
+
+    def mark_dirty(self, rect):
+        """
+        Records a repainted area of the screen and wakes up any waiters.
+        :param rect: The (x, y, w, h) tuple that was repainted.
+        :return: void
+        """
+        with self._changed:
+            self.sequence += 1
+            self._dirty.append((self.sequence, rect))
+            self._changed.notify_all()
+
+    def dirty_since(self, sequence):
+        """
+        Returns the dirty rectangles recorded after the specified sequence number. Returns None if the history no
+        longer reaches back that far, in which case callers should assume everything changed.
+        :param sequence: The sequence number to look from.
+        :return: tuple(x,y,w,h)[]
+        """
+        with self._changed:
+            if len(self._dirty) > 0 and self._dirty[0][0] > sequence + 1:
+                return None
+            return [rect for seq, rect in self._dirty if seq > sequence]
+
+    def wait(self, rect, timeout, sequence=None):
+        """
+        Blocks until the specified area is repainted or the timeout expires.
+        :param rect: The (x, y, w, h) tuple to watch or None for the whole screen.
+        :param timeout: The maximum number of seconds to wait.
+        :param sequence: Only count changes recorded after this sequence number. Defaults to now.
+        :return: bool
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            if sequence is None:
+                sequence = self.sequence
+            while True:
+                dirty = self.dirty_since(sequence)
+                if dirty is None or any(_intersects(rect, d) for d in dirty):
+                    return True
+                sequence = self.sequence
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+
+
+def _intersects(rect, other):
+    """
+    Returns True if two (x, y, w, h) rectangles overlap. A rect of None covers the whole screen.
+    :return: bool
+    """
+    if rect is None:
+        return True
+    return rect[0] < other[0] + other[2] and other[0] < rect[0] + rect[2] and \
+        rect[1] < other[1] + other[3] and other[1] < rect[1] + rect[3]
+
+
+def get_tracker():
+    """
+    Returns the damage driven change tracker, starting the damage monitor on first use. Returns None if damage
+    events are not available on this platform or change_detection is set to 'poll'.
+    :return: ChangeTracker
+    """
+    global _tracker
+    detector = str(Config.change_detection).lower()
+    if detector not in CHANGE_DETECTORS:
+        raise SimpleRPAException("change_detection must be one of " + str(CHANGE_DETECTORS) + " (received '" +
+                                 detector + "').")
+    if detector == 'poll' or not sys.platform.startswith('linux'):
+        return None
+    with _lock:
+        if _tracker is None:
+            tracker = ChangeTracker()
+            try:
+                monitor = _Capture_Linux.DamageMonitor(tracker.mark_dirty)
+            except Exception:
+                if detector == 'damage':
+                    raise
+                tracker = False
+            else:
+                monitor.start()
+            _tracker = tracker
+        return _tracker or None
+
+
+def wait_for_change(rect=None, timeout=10.0):
+    """
+    Blocks until the specified area of the screen is repainted or the timeout expires. Uses DAMAGE events when they
+    are available and otherwise polls the area comparing frame hashes.
+    :param rect: The (x, y, w, h) tuple to watch or None for the whole screen.
+    :param timeout: The maximum number of seconds to wait.
+    :return: bool
+    """
+    tracker = get_tracker()
+    if tracker is not None:
+        return tracker.wait(rect, timeout)
+
+    # region Poll the area for a different frame hash.
+    if rect is None:
+        width, height = screen_size()
+        rect = (0, 0, width, height)
+    bbox = (int(rect[0]), int(rect[1]), int(rect[0] + rect[2]), int(rect[1] + rect[3]))
+    deadline = time.monotonic() + timeout
+    original = zlib.crc32(_grab(bbox).tobytes())
+    while time.monotonic() < deadline:
+        time.sleep(min(Config.change_poll_interval, max(0.0, deadline - time.monotonic())))
+        if zlib.crc32(_grab(bbox).tobytes()) != original:
+            return True
+    return False
+    # endregion
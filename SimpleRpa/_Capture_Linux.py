@@ -0,0 +1,484 @@
+﻿# region License
+"""
+ * SimplRPA - A simple RPA library for Python and C#
+ *
+ * Copyright (c) 2009-2021 Ziglag the Orc
+ * Modifications (c) as per Git change history
+ *
+ * This Source Code Form is subject to the terms of the Mozilla
+ * Public License, v. 2.0. If a copy of the MPL was not distributed
+ * with this file, You can obtain one at
+ * https://mozilla.org/MPL/2.0/.
+ *
+ * The above copyright notice and this permission notice shall be included in all copies or substantial
+ * portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+ * LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ * IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+ * WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# endregion
+# region IMPORTS
+import os
+import sys
+import ctypes
+import ctypes.util
+import threading
+import numpy as np
+from contextlib import contextmanager
+import _Rpa_Linux
+from Xlib import X
+from Xlib.display import Display
+from Xlib.ext import damage, randr
+if sys.platform in ('java', 'darwin', 'win32'):
+    raise Exception('The _Capture_Linux module should only be loaded on a Unix system that supports X11.')
+# endregion
+
+
+# region CONSTANTS
+Z_PIXMAP = 2
+ALL_PLANES = 0xffffffff
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+# endregion
+
+
+# region XLIB STRUCTURES
+class XShmSegmentInfo(ctypes.Structure):
+    """
+    The ctypes structure for the MIT-SHM XShmSegmentInfo structure, documented in XShm.h.
+    """
+    _fields_ = [
+        ('shmseg', ctypes.c_ulong),
+        ('shmid', ctypes.c_int),
+        ('shmaddr', ctypes.c_void_p),
+        ('readOnly', ctypes.c_int),
+    ]
+
+
+class XImage(ctypes.Structure):
+    """
+    The leading fields of the Xlib XImage structure. Only the fields we read are declared, the function table at the
+    end of the structure is never touched from python.
+    """
+    _fields_ = [
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('xoffset', ctypes.c_int),
+        ('format', ctypes.c_int),
+        ('data', ctypes.c_void_p),
+        ('byte_order', ctypes.c_int),
+        ('bitmap_unit', ctypes.c_int),
+        ('bitmap_bit_order', ctypes.c_int),
+        ('bitmap_pad', ctypes.c_int),
+        ('depth', ctypes.c_int),
+        ('bytes_per_line', ctypes.c_int),
+        ('bits_per_pixel', ctypes.c_int),
+        ('red_mask', ctypes.c_ulong),
+        ('green_mask', ctypes.c_ulong),
+        ('blue_mask', ctypes.c_ulong),
+    ]
+
+
+class XErrorEvent(ctypes.Structure):
+    """
+    The ctypes structure for the Xlib XErrorEvent structure.
+    """
+    _fields_ = [
+        ('type', ctypes.c_int),
+        ('display', ctypes.c_void_p),
+        ('resourceid', ctypes.c_ulong),
+        ('serial', ctypes.c_ulong),
+        ('error_code', ctypes.c_ubyte),
+        ('request_code', ctypes.c_ubyte),
+        ('minor_code', ctypes.c_ubyte),
+    ]
+
+
+X_ERROR_HANDLER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(XErrorEvent))
+# endregion
+
+
+def _clip(bbox, width, height):
+    """
+    Clips a bounding box to the root window.
+    :param bbox: The (left, top, right, bottom) tuple to clip.
+    :param width: The width of the root window.
+    :param height: The height of the root window.
+    :return: tuple(left, top, right, bottom)
+    """
+    return max(0, bbox[0]), max(0, bbox[1]), min(width, bbox[2]), min(height, bbox[3])
+
+
+def _output(bbox, clipped, out):
+    """
+    Prepares the array a grab writes into. Areas outside the root window are left black.
+    :param bbox: The (left, top, right, bottom) tuple requested.
+    :param clipped: The (left, top, right, bottom) tuple that lies on the root window.
+    :param out: Optional preallocated (height, width, 3) uint8 array to reuse.
+    :return: numpy.array
+    """
+    if out is None:
+        return np.zeros((bbox[3] - bbox[1], bbox[2] - bbox[0], 3), dtype=np.uint8)
+    if clipped != tuple(bbox):
+        out.fill(0)
+    return out
+
+
+class XlibGrabber:
+    """
+    Grabs the screen with a plain XGetImage request on the shared _Rpa_Linux display connection.
+    """
+    name = 'xlib'
+
+    def __init__(self):
+        """
+        Constructs a new XlibGrabber instance.
+        """
+        self._lock = threading.Lock()
+        self._root = _Rpa_Linux._display.screen().root
+
+    def size(self):
+        """
+        Returns the width and height of the root window.
+        :return: tuple(width, height)
+        """
+        geometry = self._root.get_geometry()
+        return geometry.width, geometry.height
+
+    def grab(self, bbox, out=None):
+        """
+        Captures the specified area of the root window.
+        :param bbox: The (left, top, right, bottom) tuple to capture.
+        :param out: Optional preallocated (height, width, 3) uint8 array to write the pixels into.
+        :return: numpy.array
+        """
+        with self._lock:
+            left, top, right, bottom = _clip(bbox, *self.size())
+            frame = _output(bbox, (left, top, right, bottom), out)
+            if right <= left or bottom <= top:
+                return frame
+            reply = self._root.get_image(left, top, right - left, bottom - top, X.ZPixmap, ALL_PLANES)
+        bgrx = np.frombuffer(reply.data, dtype=np.uint8).reshape(bottom - top, right - left, 4)
+        frame[top - bbox[1]:bottom - bbox[1], left - bbox[0]:right - bbox[0]] = bgrx[:, :, 2::-1]
+        return frame
+
+    def close(self):
+        """
+        Releases the grabber. The shared display connection stays open.
+        :return: void
+        """
+        return
+
+
+class XShmGrabber:
+    """
+    Grabs the screen through a long lived MIT-SHM segment so the X server writes the pixels straight into our memory
+    instead of streaming them over the socket.
+    """
+    name = 'xshm'
+
+    def __init__(self):
+        """
+        Opens a dedicated Xlib connection and attaches a shared memory segment large enough for the root window.
+        Raises OSError if MIT-SHM is not available on this display.
+        """
+        self._lock = threading.Lock()
+        self._errors = list()
+        self._previous = None
+        self._xlib = ctypes.cdll.LoadLibrary(ctypes.util.find_library('X11'))
+        self._xext = ctypes.cdll.LoadLibrary(ctypes.util.find_library('Xext'))
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._declare()
+
+        self._dpy = self._xlib.XOpenDisplay(os.environ['DISPLAY'].encode('utf-8'))
+        if not self._dpy:
+            raise OSError("Unable to open display '" + os.environ['DISPLAY'] + "'.")
+        if not self._xext.XShmQueryExtension(self._dpy):
+            self._xlib.XCloseDisplay(self._dpy)
+            raise OSError('The MIT-SHM extension is not available on this display.')
+
+        # The default Xlib error handler terminates the process. Ours is only installed around our own requests, see
+        # _trapped, but must stay referenced for our lifetime.
+        self._handler = X_ERROR_HANDLER(self._on_error)
+
+        screen = self._xlib.XDefaultScreen(self._dpy)
+        self._root = self._xlib.XDefaultRootWindow(self._dpy)
+        self._visual = self._xlib.XDefaultVisual(self._dpy, screen)
+        self._depth = self._xlib.XDefaultDepth(self._dpy, screen)
+        self._shminfo = None
+        self._attach(*self.size())
+
+    def _declare(self):
+        """
+        Declares the argument and return types of the native functions we call.
+        :return: void
+        """
+        self._xlib.XOpenDisplay.restype = ctypes.c_void_p
+        self._xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        self._xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        self._xlib.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        self._xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+        self._xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        self._xlib.XDefaultVisual.restype = ctypes.c_void_p
+        self._xlib.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        self._xlib.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        self._xlib.XGetGeometry.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(ctypes.c_ulong),
+                                            ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int),
+                                            ctypes.POINTER(ctypes.c_uint), ctypes.POINTER(ctypes.c_uint),
+                                            ctypes.POINTER(ctypes.c_uint), ctypes.POINTER(ctypes.c_uint)]
+        self._xlib.XSetErrorHandler.restype = ctypes.c_void_p
+        self._xlib.XSetErrorHandler.argtypes = [ctypes.c_void_p]
+        self._xlib.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        self._xlib.XDestroyImage.argtypes = [ctypes.POINTER(XImage)]
+        self._xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        self._xext.XShmCreateImage.restype = ctypes.POINTER(XImage)
+        self._xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                                               ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo),
+                                               ctypes.c_uint, ctypes.c_uint]
+        self._xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+        self._xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(XShmSegmentInfo)]
+        self._xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(XImage),
+                                            ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+        self._libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        self._libc.shmat.restype = ctypes.c_void_p
+        self._libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        self._libc.shmdt.argtypes = [ctypes.c_void_p]
+        self._libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+    def _on_error(self, dpy, event):
+        """
+        Records X errors raised by our requests instead of letting Xlib abort the process. Errors of other display
+        connections, such as the one of the widget, are passed on to the handler we replaced.
+        :return: int
+        """
+        if dpy != self._dpy and self._previous:
+            return X_ERROR_HANDLER(self._previous)(dpy, event)
+        self._errors.append(event.contents.error_code)
+        return 0
+
+    @contextmanager
+    def _trapped(self):
+        """
+        Installs our error handler for the duration of the block and syncs with the X server before restoring the
+        previous handler, so the errors of the requests made inside the block are in self._errors afterwards.
+        :return: contextmanager
+        """
+        del self._errors[:]
+        self._previous = self._xlib.XSetErrorHandler(ctypes.cast(self._handler, ctypes.c_void_p))
+        try:
+            yield
+            self._xlib.XSync(self._dpy, 0)
+        finally:
+            self._xlib.XSetErrorHandler(self._previous)
+            self._previous = None
+
+    def _attach(self, width, height):
+        """
+        Creates and attaches a shared memory segment big enough to hold a width x height 32 bit frame.
+        :param width: The width of the largest frame the segment must hold.
+        :param height: The height of the largest frame the segment must hold.
+        :return: void
+        """
+        self._detach()
+        self._capacity = width * height * 4
+        shminfo = XShmSegmentInfo()
+        shminfo.shmid = self._libc.shmget(IPC_PRIVATE, self._capacity, IPC_CREAT | 0o600)
+        if shminfo.shmid < 0:
+            raise OSError(ctypes.get_errno(), 'shmget failed for the MIT-SHM segment.')
+        shminfo.shmaddr = self._libc.shmat(shminfo.shmid, None, 0)
+        if shminfo.shmaddr in (None, ctypes.c_void_p(-1).value):
+            self._libc.shmctl(shminfo.shmid, IPC_RMID, None)
+            raise OSError(ctypes.get_errno(), 'shmat failed for the MIT-SHM segment.')
+        shminfo.readOnly = 0
+
+        with self._trapped():
+            self._xext.XShmAttach(self._dpy, ctypes.byref(shminfo))
+        # Mark the segment for removal now, it lives on until both we and the X server have detached from it.
+        self._libc.shmctl(shminfo.shmid, IPC_RMID, None)
+        if len(self._errors) > 0:
+            self._libc.shmdt(shminfo.shmaddr)
+            raise OSError('The X server refused to attach the MIT-SHM segment (remote display?).')
+        self._shminfo = shminfo
+
+    def _detach(self):
+        """
+        Detaches and releases the current shared memory segment if there is one.
+        :return: void
+        """
+        if self._shminfo is None:
+            return
+        with self._trapped():
+            self._xext.XShmDetach(self._dpy, ctypes.byref(self._shminfo))
+        self._libc.shmdt(self._shminfo.shmaddr)
+        self._shminfo = None
+
+    def size(self):
+        """
+        Returns the width and height of the root window. The root is queried directly because Xlib does not update
+        its cached display size when RandR resizes the screen.
+        :return: tuple(width, height)
+        """
+        root = ctypes.c_ulong()
+        x, y = ctypes.c_int(), ctypes.c_int()
+        width, height, border, depth = ctypes.c_uint(), ctypes.c_uint(), ctypes.c_uint(), ctypes.c_uint()
+        self._xlib.XGetGeometry(self._dpy, self._root, ctypes.byref(root), ctypes.byref(x), ctypes.byref(y),
+                                ctypes.byref(width), ctypes.byref(height), ctypes.byref(border), ctypes.byref(depth))
+        return width.value, height.value
+
+    def grab(self, bbox, out=None):
+        """
+        Captures the specified area of the root window.
+        :param bbox: The (left, top, right, bottom) tuple to capture.
+        :param out: Optional preallocated (height, width, 3) uint8 array to write the pixels into.
+        :return: numpy.array
+        """
+        with self._lock:
+            screen_width, screen_height = self.size()
+            left, top, right, bottom = _clip(bbox, screen_width, screen_height)
+            frame = _output(bbox, (left, top, right, bottom), out)
+            if right <= left or bottom <= top:
+                return frame
+            if (right - left) * (bottom - top) * 4 > self._capacity:
+                self._attach(screen_width, screen_height)
+
+            # The image header is client side only and points at the start of our attached segment, XShmGetImage
+            # sends the offset of the image data within the segment.
+            image = self._xext.XShmCreateImage(self._dpy, self._visual, self._depth, Z_PIXMAP, self._shminfo.shmaddr,
+                                               ctypes.byref(self._shminfo), right - left, bottom - top)
+            if not image:
+                raise OSError('XShmCreateImage failed.')
+            try:
+                if image.contents.bits_per_pixel != 32:
+                    raise OSError('Only 32 bits per pixel visuals are supported by the MIT-SHM grabber.')
+                with self._trapped():
+                    ok = self._xext.XShmGetImage(self._dpy, self._root, image, left, top, ALL_PLANES)
+                if not ok or len(self._errors) > 0:
+                    raise OSError('XShmGetImage failed.')
+                stride = image.contents.bytes_per_line
+                buf = (ctypes.c_ubyte * (stride * (bottom - top))).from_address(self._shminfo.shmaddr)
+                bgrx = np.frombuffer(buf, dtype=np.uint8).reshape(bottom - top, stride // 4, 4)
+                frame[top - bbox[1]:bottom - bbox[1], left - bbox[0]:right - bbox[0]] = \
+                    bgrx[:, :right - left, 2::-1]
+            finally:
+                # The data belongs to the segment, XDestroyImage must not free it.
+                image.contents.data = None
+                self._xlib.XDestroyImage(image)
+        return frame
+
+    def close(self):
+        """
+        Detaches the shared memory segment and closes the dedicated display connection.
+        :return: void
+        """
+        with self._lock:
+            self._detach()
+            if self._dpy:
+                self._xlib.XCloseDisplay(self._dpy)
+                self._dpy = None
+
+
+class DamageMonitor(threading.Thread):
+    """
+    Listens for DAMAGE extension events on the root window and reports every repainted rectangle. The monitor runs
+    on its own display connection so it never competes with _Rpa_Linux._display for events.
+    """
+    def __init__(self, on_damage):
+        """
+        Constructs a new DamageMonitor instance. Raises OSError if the DAMAGE extension is not available.
+        :param on_damage: Called with an (x, y, w, h) tuple for every damaged area of the screen.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.on_damage = on_damage
+        self._display = Display(os.environ['DISPLAY'])
+        if not self._display.has_extension('DAMAGE'):
+            self._display.close()
+            raise OSError('The DAMAGE extension is not available on this display.')
+        self._display.damage_query_version()
+        self._damage = self._display.screen().root.damage_create(damage.DamageReportRawRectangles)
+        self._display.flush()
+
+    def run(self):
+        """
+        Pumps events from the display connection until the process exits.
+        :return: void
+        """
+        event_type = self._display.extension_event.DamageNotify
+        while True:
+            event = self._display.next_event()
+            if event.type == event_type:
+                area = event.area
+                self.on_damage((area.x, area.y, area.width, area.height))
+
+
+class RandrMonitor(threading.Thread):
+    """
+    Listens for RandR screen change events on the root window and reports the new root geometry and monitor layout,
+    so callers can cache them instead of asking for them on every request.
+    """
+    def __init__(self, on_change):
+        """
+        Constructs a new RandrMonitor instance. Raises OSError if the RANDR extension is not available.
+        :param on_change: Called with the new (width, height) of the root window and the list of monitors whenever
+        they change.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.on_change = on_change
+        self._display = Display(os.environ['DISPLAY'])
+        extension = self._display.query_extension('RANDR')
+        if extension is None or not extension.present:
+            self._display.close()
+            raise OSError('The RANDR extension is not available on this display.')
+        self._event_type = extension.first_event + randr.RRScreenChangeNotify
+        self._root = self._display.screen().root
+        self._root.xrandr_select_input(randr.RRScreenChangeNotifyMask)
+        self._display.flush()
+
+    def size(self):
+        """
+        Returns the width and height of the root window.
+        :return: tuple(width, height)
+        """
+        geometry = self._root.get_geometry()
+        return geometry.width, geometry.height
+
+    def monitors(self):
+        """
+        Returns the active monitors of the display. Uses the RandR 1.5 monitor list and falls back to the enabled
+        CRTCs on older servers.
+        :return: tuple(name, x, y, width, height, primary)[]
+        """
+        try:
+            reply = self._root.xrandr_get_monitors(is_active=True)
+            return [(self._display.get_atom_name(m.name), m.x, m.y, m.width_in_pixels, m.height_in_pixels,
+                     bool(m.primary)) for m in reply.monitors]
+        except Exception:
+            resources = self._root.xrandr_get_screen_resources()
+            primary = self._root.xrandr_get_output_primary().output
+            monitors = list()
+            for crtc in resources.crtcs:
+                info = self._display.xrandr_get_crtc_info(crtc, resources.config_timestamp)
+                if info.mode == 0 or info.width == 0 or info.height == 0:
+                    continue
+                name = 'crtc-' + str(crtc)
+                if len(info.outputs) > 0:
+                    name = self._display.xrandr_get_output_info(info.outputs[0], resources.config_timestamp).name
+                    if isinstance(name, bytes):
+                        name = name.decode('utf-8', 'replace')
+                monitors.append((name, info.x, info.y, info.width, info.height, primary in info.outputs))
+            return monitors
+
+    def run(self):
+        """
+        Pumps events from the display connection until the process exits.
+        :return: void
+        """
+        while True:
+            event = self._display.next_event()
+            if event.type == self._event_type:
+                self.on_change(self.size(), self.monitors())
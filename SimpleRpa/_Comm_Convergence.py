@@ -28,11 +28,17 @@ import Mouse
 import Screen
 import SimpleOcr
 import _Steganography
+import _Flight_Recorder
+import _Video_Recorder
 import _Platform_Convergence as pc
 from _Platform_Convergence import Config
 from Keyboard import Console
 from colorama import Fore
 
+# Methods that wait for or report changes of the live screen, they are never run on a frozen frame.
+LIVE_METHODS = ('screen_wait_for_image', 'screen_wait_for_change', 'screen_stream', 'screen_stream_close',
+                'screen_diff', 'screen_start_video', 'screen_stop_video', 'screen_get_video_stats')
+
 
 def run_method(verbose_level, wr, jsn, key, iv):
     """
@@ -45,7 +51,18 @@ def run_method(verbose_level, wr, jsn, key, iv):
     :return: json
     """
     _log_request(verbose_level, wr, jsn)
-    reply = _run_corresponding_method(wr, key, iv)
+    _Flight_Recorder.note(str(wr.get('method')))
+    try:
+        reply = _run_corresponding_method(wr, key, iv)
+    except Exception as e:
+        # region Keep the frames leading up to the failure.
+        if Config.recorder_dump_on_exception:
+            try:
+                _Flight_Recorder.dump_exception(str(wr.get('method')) + ": " + type(e).__name__ + ": " + str(e))
+            except Exception:
+                do_nothing = True
+        raise
+        # endregion
     _log_response(verbose_level, wr, reply)
     return reply
 
@@ -128,8 +145,16 @@ def _run_corresponding_method(wr, key, iv):
     :param key: The key to use for encryption routines.
     :param iv: The initialization vector to use for encryption routines.
     """
-    # region MOUSE METHODS
     method = str(wr['method'])
+    # region FROZEN FRAME
+    if 'frame_id' in wr and (method.startswith('screen') or method.startswith('simple_ocr')) and \
+            method not in LIVE_METHODS:
+        wr = dict(wr)
+        with Screen.frozen(wr.pop('frame_id')) as frame_id:
+            reply = _run_corresponding_method(wr, key, iv)
+        return _attach_frame_id(reply, frame_id)
+    # endregion
+    # region MOUSE METHODS
     if method.startswith('mouse'):
         if method == 'mouse_move':
             wr['use_widget'], wr['duration'] = _get_widget_settings(wr['use_widget'], wr['duration'])
@@ -191,39 +216,144 @@ def _run_corresponding_method(wr, key, iv):
     elif method.startswith("screen"):
         if method == 'screen_capture':
             wr['use_widget'], wr['duration'] = _get_widget_settings(wr['use_widget'], wr['duration'])
-            img = Screen.capture((wr['x'], wr['y'], wr['width'], wr['height'], wr['use_widget'], wr['duration']))
-            ary = img.tobytes()
+            if isinstance(wr.get('region'), str):
+                x, y, w, h = Screen.resolve_region(wr['region'])
+                rct = (x, y, x + w, y + h)
+            else:
+                rct = (wr['x'], wr['y'], wr['width'], wr['height'])
+            img = Screen.capture(rct + (wr['use_widget'], wr['duration']), monitor=_get_monitor(wr))
+            encoded = Screen.encode(img, wr.get('format', Screen.ImageFormats.RAW), wr.get('quality'),
+                                    wr.get('scale', 1))
+            ary = encoded.data
             attach = _Steganography.encrypt_bytes(ary, key, iv)
             lng = base64.b64encode(str(len(ary)).encode('utf-8')).decode('utf-8')
-            reply = '{"response":"SUCCESS","content":"' + attach + '","length":"' + lng + '"}'
+            reply = json.dumps({"response": "SUCCESS", "content": attach, "length": lng, "width": encoded.width,
+                                "height": encoded.height, "mode": encoded.mode, "format": encoded.format})
+        elif method == 'screen_stream':
+            stream_id, frame = Screen.stream_frame(wr.get('stream_id'), wr.get('ack'), _get_region(wr))
+            attach = _Steganography.encrypt_bytes(frame.payload, key, iv)
+            lng = base64.b64encode(str(len(frame.payload)).encode('utf-8')).decode('utf-8')
+            reply = json.dumps({"response": "SUCCESS", "stream_id": stream_id, "frame": frame.frame,
+                                "keyframe": frame.keyframe, "width": frame.width, "height": frame.height,
+                                "tile_size": frame.tile_size, "tiles": frame.tiles, "content": attach,
+                                "length": lng})
+        elif method == 'screen_diff':
+            previous, current, changes, ratio = Screen.diff_last(_get_region(wr), wr.get('threshold'),
+                                                                 _get_monitor(wr))
+            changes = [{"x": x, "y": y, "width": w, "height": h, "ratio": r} for x, y, w, h, r in changes]
+            reply = json.dumps({"response": "SUCCESS", "from_frame_id": previous, "to_frame_id": current,
+                                "ratio": ratio, "changes": changes})
+        elif method == 'screen_stream_close':
+            Screen.close_stream(wr['stream_id'])
+            reply = json.dumps({"response": "SUCCESS"})
         elif method == 'screen_get_pixel_color':
             wr['use_widget'], wr['duration'] = _get_widget_settings(wr['use_widget'], wr['duration'])
-            color = Screen.get_pixel_color((wr['x'], wr['y']), wr['use_widget'], wr['duration'])
+            color = Screen.get_pixel_color(_get_point(wr), wr['use_widget'], wr['duration'],
+                                           _get_monitor(wr))
             reply = json.dumps({"response": "SUCCESS", "red": str(color[0]), "green": str(color[1]), "blue": str(color[2]),
                      "name": ""})
         elif method == 'screen_get_known_color':
             wr['use_widget'], wr['duration'] = _get_widget_settings(wr['use_widget'], wr['duration'])
-            color = Screen.get_known_color((wr['x'], wr['y']), wr['use_widget'], wr['duration'])
+            color = Screen.get_known_color(_get_point(wr), wr['use_widget'], wr['duration'],
+                                           _get_monitor(wr))
             reply = json.dumps({"response": "SUCCESS", "red": str(color.r), "green": str(color.g), "blue": str(color.b),
                      "name": color.name})
         elif method == 'screen_get_console_color':
             wr['use_widget'], wr['duration'] = _get_widget_settings(wr['use_widget'], wr['duration'])
-            color = Screen.get_console_color((wr['x'], wr['y']), wr['use_widget'], wr['duration'])
+            color = Screen.get_console_color(_get_point(wr), wr['use_widget'], wr['duration'],
+                                             _get_monitor(wr))
             reply = json.dumps({"response": "SUCCESS", "red": str(color.r), "green": str(color.g), "blue": str(color.b),
                      "name": color.name})
+        elif method == 'screen_get_pixel_colors':
+            wr['use_widget'], wr['duration'] = _get_widget_settings(wr['use_widget'], wr['duration'])
+            colors = Screen.get_pixel_colors(_get_points(wr['points'], wr), wr['use_widget'], wr['duration'],
+                                             _get_monitor(wr))
+            reply = json.dumps({"response": "SUCCESS", "colors": [
+                {"red": str(c[0]), "green": str(c[1]), "blue": str(c[2]), "name": ""} for c in colors]})
+        elif method == 'screen_get_known_colors':
+            wr['use_widget'], wr['duration'] = _get_widget_settings(wr['use_widget'], wr['duration'])
+            colors = Screen.get_known_colors(_get_points(wr['points'], wr), wr['use_widget'], wr['duration'],
+                                             _get_monitor(wr))
+            reply = json.dumps({"response": "SUCCESS", "colors": [
+                {"red": str(c.r), "green": str(c.g), "blue": str(c.b), "name": c.name} for c in colors]})
+        elif method == 'screen_get_console_colors':
+            wr['use_widget'], wr['duration'] = _get_widget_settings(wr['use_widget'], wr['duration'])
+            colors = Screen.get_console_colors(_get_points(wr['points'], wr), wr['use_widget'], wr['duration'],
+                                               _get_monitor(wr))
+            reply = json.dumps({"response": "SUCCESS", "colors": [
+                {"red": str(c.r), "green": str(c.g), "blue": str(c.b), "name": c.name} for c in colors]})
+        elif method == 'screen_wait_for_change':
+            changed = Screen.wait_for_change(_get_rect(wr), float(wr['timeout']))
+            reply = json.dumps({"response": "SUCCESS", "changed": changed})
         elif method == 'screen_find_image':
             # region Compile JSON list of locations.
             wr['use_widget'], wr['duration'] = _get_widget_settings(wr['use_widget'], wr['duration'])
-            locs = Screen.find_image(wr['filename'], wr['threshold'], wr['use_widget'], wr['duration'])
-            temp = '{"x":<X>,"y":<Y>,"w":<W>,"h":<H>}'
-            text = '['
-            leng = len(locs)
-            for i in range(leng):
-                text += temp.replace('<X>', str(locs[i][0])).replace('<Y>', str(locs[i][1])).replace('<W>', str(
-                    locs[i][2])).replace('<H>', str(locs[i][3])) + ','
-            text = text[0:len(text) - 1] + ']'
+            locs = Screen.find_image(wr['filename'], wr['threshold'], wr['use_widget'], wr['duration'],
+                                     _get_region(wr), wr.get('mode', Screen.MatchModes.EXACT),
+                                     wr.get('max_results'), wr.get('best_only', False), wr.get('suppress'), True,
+                                     _get_monitor(wr), wr.get('use_hints'))
+            locs = [{"x": x, "y": y, "w": w, "h": h, "score": score} for x, y, w, h, score in locs]
+            # endregion
+            reply = json.dumps({"response": "SUCCESS", "locs": locs})
+        elif method == 'screen_find_images':
+            # region Compile JSON lists of locations keyed by file.
+            wr['use_widget'], wr['duration'] = _get_widget_settings(wr['use_widget'], wr['duration'])
+            results = Screen.find_images(wr['filenames'], wr['threshold'], wr['use_widget'], wr['duration'],
+                                         _get_region(wr), wr.get('mode', Screen.MatchModes.EXACT),
+                                         wr.get('max_results'), wr.get('best_only', False), wr.get('suppress'), True,
+                                         _get_monitor(wr), wr.get('use_hints'))
+            for file in results:
+                results[file] = [{"x": x, "y": y, "w": w, "h": h, "score": score}
+                                 for x, y, w, h, score in results[file]]
             # endregion
-            reply = json.dumps(json.loads('{"response":"SUCCESS","locs":<LOCS>}'.replace('<LOCS>', text)))
+            reply = json.dumps({"response": "SUCCESS", "results": results})
+        elif method == 'screen_element_map':
+            elements = [{"x": e.x, "y": e.y, "width": e.width, "height": e.height, "red": e.color[0],
+                         "green": e.color[1], "blue": e.color[2]}
+                        for e in Screen.element_map(_get_region(wr), _get_monitor(wr))]
+            reply = json.dumps({"response": "SUCCESS", "elements": elements})
+        elif method == 'screen_wait_for_image':
+            wr['use_widget'], wr['duration'] = _get_widget_settings(wr['use_widget'], wr['duration'])
+            locs = Screen.wait_for_image(wr['filename'], wr['threshold'], float(wr['timeout']), _get_region(wr),
+                                         wr['use_widget'], wr['duration'], wr.get('mode', Screen.MatchModes.EXACT),
+                                         True, _get_monitor(wr))
+            if len(locs) == 0:
+                reply = json.dumps({"response": "TIMEOUT"})
+            else:
+                locs = [{"x": x, "y": y, "w": w, "h": h, "score": score} for x, y, w, h, score in locs]
+                reply = json.dumps({"response": "SUCCESS", "locs": locs})
+        elif method == 'screen_get_monitors':
+            monitors = [{"index": m.index, "name": m.name, "x": m.x, "y": m.y, "width": m.width, "height": m.height,
+                         "primary": m.primary} for m in Screen.get_monitors()]
+            reply = json.dumps({"response": "SUCCESS", "monitors": monitors})
+        elif method == 'screen_dump_recording':
+            folder = _Flight_Recorder.dump(wr.get('folder'), 'requested')
+            recorder = _Flight_Recorder.get_recorder()
+            stats = recorder.stats() if recorder is not None else None
+            reply = json.dumps({"response": "SUCCESS", "folder": folder, "stats": stats})
+        elif method == 'screen_register_region':
+            Screen.register_region(wr['name'], (wr['x'], wr['y'], wr['width'], wr['height']), wr.get('anchor'),
+                                   wr.get('threshold', 0.9), _get_region(wr, 'search'), wr.get('monitor'))
+            reply = json.dumps({"response": "SUCCESS"})
+        elif method == 'screen_unregister_region':
+            removed = Screen.unregister_region(wr['name'])
+            reply = json.dumps({"response": "SUCCESS", "removed": removed})
+        elif method == 'screen_get_regions':
+            reply = json.dumps({"response": "SUCCESS", "regions": Screen.get_regions()})
+        elif method == 'screen_resolve_region':
+            x, y, w, h = Screen.resolve_region(wr['name'])
+            reply = json.dumps({"response": "SUCCESS", "x": x, "y": y, "width": w, "height": h})
+        elif method == 'screen_start_video':
+            recorder = _Video_Recorder.start(wr.get('path'), wr.get('fps'), wr.get('encoder'))
+            reply = json.dumps({"response": "SUCCESS", "stats": recorder.stats()})
+        elif method == 'screen_stop_video':
+            reply = json.dumps({"response": "SUCCESS", "stats": _Video_Recorder.stop()})
+        elif method == 'screen_get_video_stats':
+            recorder = _Video_Recorder.get_recorder()
+            stats = recorder.stats() if recorder is not None else None
+            reply = json.dumps({"response": "SUCCESS", "stats": stats})
+        elif method == 'screen_get_cache_stats':
+            reply = json.dumps({"response": "SUCCESS", "stats": Screen.get_cache_stats()})
     # endregion
     # region OCR METHODS
     elif method.startswith("simple_ocr"):
@@ -232,9 +362,8 @@ def _run_corresponding_method(wr, key, iv):
             reply = json.dumps({"response": "SUCCESS"})
         elif method == 'simple_ocr_perform_ocr':
             wr['use_widget'], wr['duration'] = _get_widget_settings(wr['use_widget'], wr['duration'])
-            text = SimpleOcr.perform_ocr(wr['font_maps'], (wr['x'], wr['y'], wr['width'], wr['height']),
-                                         wr['ocr_threshold'], wr['capture_threshold'],
-                                         wr['use_widget'], wr['duration'])
+            text = SimpleOcr.perform_ocr(wr['font_maps'], _get_rect(wr), wr['ocr_threshold'], wr['capture_threshold'],
+                                         wr['use_widget'], wr['duration'], _get_monitor(wr))
             reply = json.dumps({"response": "SUCCESS", "text": text})
     # endregion
     elif method == "shut_down":
@@ -242,6 +371,98 @@ def _run_corresponding_method(wr, key, iv):
     return reply
 
 
+def _attach_frame_id(reply, frame_id):
+    """
+    Adds the id of the frame a screen method read from to its json reply.
+    :param reply: The json reply of the screen method.
+    :param frame_id: The id of the frame that was used.
+    :return: json
+    """
+    rep = json.loads(reply)
+    rep['frame_id'] = frame_id
+    return json.dumps(rep)
+
+
+def _get_points(points, wr=None):
+    """
+    Converts the points of a web request into a list of (x, y) tuples.
+    :param points: A list of {"x":0,"y":0} objects or [x, y] pairs.
+    :param wr: Optional web request, points are relative to its named region if it has one.
+    :return: tuple[]
+    """
+    dx, dy = _get_origin(wr)
+    pts = list()
+    for pt in points:
+        if isinstance(pt, dict):
+            pts.append((int(pt['x']) + dx, int(pt['y']) + dy))
+        else:
+            pts.append((int(pt[0]) + dx, int(pt[1]) + dy))
+    return pts
+
+
+def _get_point(wr):
+    """
+    Reads the point of a web request, relative to its named region if it has one.
+    :param wr: The web request containing "x" and "y".
+    :return: tuple(x, y)
+    """
+    dx, dy = _get_origin(wr)
+    return wr['x'] + dx, wr['y'] + dy
+
+
+def _get_origin(wr):
+    """
+    Returns the desktop position of the named region of a web request.
+    :param wr: The web request or None.
+    :return: tuple(x, y) or (0, 0) if the request has no named region
+    """
+    if wr is None or not isinstance(wr.get('region'), str):
+        return 0, 0
+    rct = Screen.resolve_region(wr['region'])
+    return rct[0], rct[1]
+
+
+def _get_rect(wr):
+    """
+    Reads the area of a web request, either a named region or its "x", "y", "width" and "height".
+    :param wr: The web request.
+    :return: tuple(x,y,w,h)
+    """
+    if isinstance(wr.get('region'), str):
+        return Screen.resolve_region(wr['region'])
+    return wr['x'], wr['y'], wr['width'], wr['height']
+
+
+def _get_monitor(wr):
+    """
+    Reads the optional monitor of a web request. Named regions are resolved to desktop coordinates, so the monitor is
+    ignored when the request has one.
+    :param wr: The web request.
+    :return: The index or name of the monitor or None
+    """
+    if isinstance(wr.get('region'), str):
+        return None
+    return wr.get('monitor')
+
+
+def _get_region(wr, prop='region'):
+    """
+    Reads the optional search region of a web request.
+    :param wr: The web request that may contain a region as {"x":0,"y":0,"width":0,"height":0}, [x, y, w, h] or the
+    name of a registered region.
+    :param prop: The name of the member holding the region.
+    :return: tuple(x,y,w,h) or None
+    """
+    region = wr.get(prop)
+    if region is None:
+        return None
+    if isinstance(region, str):
+        return Screen.resolve_region(region)
+    if isinstance(region, dict):
+        return int(region['x']), int(region['y']), int(region['width']), int(region['height'])
+    return int(region[0]), int(region[1]), int(region[2]), int(region[3])
+
+
 def _get_widget_settings(use_widget, duration):
     """
     Returns the default settings for widgets. If the widget is explicitly set to True of False then the current setting
@@ -0,0 +1,295 @@
+﻿# region License
+"""
+ * SimplRPA - A simple RPA library for Python and C#
+ *
+ * Copyright (c) 2009-2021 Ziglag the Orc
+ * Modifications (c) as per Git change history
+ *
+ * This Source Code Form is subject to the terms of the Mozilla
+ * Public License, v. 2.0. If a copy of the MPL was not distributed
+ * with this file, You can obtain one at
+ * https://mozilla.org/MPL/2.0/.
+ *
+ * The above copyright notice and this permission notice shall be included in all copies or substantial
+ * portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+ * LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ * IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+ * WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# endregion
+import threading
+import collections
+import cv2
+import numpy as np
+import _Capture_Convergence
+import _Tile_Index
+from _Platform_Convergence import Config
+
+CANNY_LOW = 50
+CANNY_HIGH = 150
+RECTANGULARITY = 0.8
+DUPLICATE_OVERLAP = 0.8
+BORDER = 4
+COLOR_SAMPLES = 4096
+FULL_PASS_RATIO = 0.5
+# The 3x3 Sobel aperture of Canny and the 3x3 closing each read one pixel beyond an edge, an outline must lie this far
+# inside a partial pass to be traced the same way as in a full one.
+PADDING = BORDER + 2
+
+
+class Element:
+    """
+    A rectangular candidate UI element such as a button, text box or checkbox.
+    """
+    def __init__(self, x, y, width, height, color):
+        """
+        Constructs a new Element instance.
+        :param x: The left of the element in desktop coordinates.
+        :param y: The top of the element in desktop coordinates.
+        :param width: The width of the element.
+        :param height: The height of the element.
+        :param color: The (r, g, b) tuple of the most common color inside the element.
+        """
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.color = color
+
+    @property
+    def bbox(self):
+        """
+        The (left, top, right, bottom) area of the element.
+        :return: tuple
+        """
+        return self.x, self.y, self.x + self.width, self.y + self.height
+
+
+class ElementMaps:
+    """
+    A least recently used cache of the element maps of screen areas. A map is kept with the hashes of the tiles it was
+    detected from. When tiles change only the area around them is detected again.
+    """
+    def __init__(self):
+        """
+        Constructs a new ElementMaps instance.
+        """
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.full = 0
+        self.partial = 0
+
+    def get(self, bbox):
+        """
+        Returns the elements of a screen area, detecting only what changed since the area was last mapped.
+        :param bbox: The (left, top, right, bottom) area to map.
+        :return: Element[]
+        """
+        pixels, hashes = _Tile_Index.grab(bbox)
+        with self._lock:
+            entry = self._entries.get(bbox)
+            if entry is not None:
+                self._entries.move_to_end(bbox)
+                if entry[0] == hashes:
+                    self.hits += 1
+                    return list(entry[1])
+
+        frame = _Capture_Convergence.frame_for(bbox, pixels)
+        area = None if entry is None else _dirty_area(bbox, entry[0], hashes, entry[1])
+        found = None
+        while area is not None:
+            # An outline drawn across the edge of the area is only traced in part, detect again around all of it.
+            found = _detect(frame, area, False)
+            grown = _grow(area, entry[1] + found, bbox)
+            if grown == area:
+                break
+            area = grown if not _too_large(grown, bbox) else None
+        if area is None:
+            elements = _detect(frame, bbox)
+        else:
+            elements = [e for e in entry[1] if not _intersects(e.bbox, area)] + found
+            elements.sort(key=lambda e: (e.y, e.x))
+
+        with self._lock:
+            if area is None:
+                self.full += 1
+            else:
+                self.partial += 1
+            self._entries[bbox] = (hashes, elements)
+            self._entries.move_to_end(bbox)
+            while len(self._entries) > max(1, int(Config.element_map_entries)):
+                self._entries.popitem(last=False)
+        return list(elements)
+
+    def clear(self):
+        """
+        Drops every cached map.
+        :return: void
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache counters.
+        :return: dict
+        """
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "full": self.full, "partial": self.partial}
+
+
+def _dirty_area(bbox, old, new, elements):
+    """
+    Returns the area to detect again after some tiles changed. It covers the changed tiles and every previously
+    detected element touching them with PADDING pixels to spare, so no outline falls on the edge of the area.
+    :param bbox: The (left, top, right, bottom) area of the map.
+    :param old: The tile hashes the map was detected from.
+    :param new: The current tile hashes.
+    :param elements: The previously detected elements.
+    :return: tuple(left, top, right, bottom) or None if the whole area should be detected again
+    """
+    dirty = [t for t, a, b in zip(_Tile_Index.index.tiles(_Tile_Index.index.align(bbox)), old, new) if a != b]
+    if len(dirty) == 0 or len(old) != len(new):
+        return None
+    area = _grow(_pad(_union(dirty), bbox), elements, bbox)
+    return None if _too_large(area, bbox) else area
+
+
+def _grow(area, elements, bbox):
+    """
+    Grows an area until it covers every element touching it with PADDING pixels to spare.
+    :param area: The (left, top, right, bottom) area to grow.
+    :param elements: The elements that must not be cut.
+    :param bbox: The (left, top, right, bottom) area of the map.
+    :return: tuple(left, top, right, bottom)
+    """
+    grown = True
+    while grown:
+        grown = False
+        for e in elements:
+            if _intersects(e.bbox, area):
+                union = _union([area, _pad(e.bbox, bbox)])
+                if union != area:
+                    area = union
+                    grown = True
+    return area
+
+
+def _too_large(area, bbox):
+    """
+    Returns True if an area covers so much of the map that a full pass is cheaper.
+    :return: bool
+    """
+    return (area[2] - area[0]) * (area[3] - area[1]) > FULL_PASS_RATIO * (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+
+
+def _detect(frame, bbox, whole=True):
+    """
+    Runs one edge and contour detection pass over an area of a frame and keeps the closed, roughly rectangular
+    outlines.
+    :param frame: The Frame to detect in.
+    :param bbox: The (left, top, right, bottom) area of the frame to detect in.
+    :param whole: If true the area is the whole map and an outline filling all of it is the edge of the area itself.
+    :return: Element[]
+    """
+    gray = frame.gray(bbox)
+    pixels = frame.crop(bbox)
+    edges = cv2.morphologyEx(cv2.Canny(gray, CANNY_LOW, CANNY_HIGH), cv2.MORPH_CLOSE,
+                             np.ones((3, 3), dtype=np.uint8))
+    contours = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)[-2]
+
+    # region Keep rectangular outlines, largest first so the outer edge of a border wins over its inner edge.
+    size = int(Config.element_min_size)
+    boxes = list()
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w < size or h < size or (whole and w >= gray.shape[1] and h >= gray.shape[0]):
+            continue
+        if cv2.contourArea(contour) < RECTANGULARITY * w * h:
+            continue
+        boxes.append((x, y, w, h))
+    boxes.sort(key=lambda b: -b[2] * b[3])
+    kept = list()
+    for box in boxes:
+        if all(_overlap(box, k) < DUPLICATE_OVERLAP and not _is_border(box, k) for k in kept):
+            kept.append(box)
+    # endregion
+
+    return [Element(x + bbox[0], y + bbox[1], w, h, _dominant_color(pixels[y:y + h, x:x + w]))
+            for x, y, w, h in sorted(kept, key=lambda b: (b[1], b[0]))]
+
+
+def _dominant_color(pixels):
+    """
+    Returns the most common color of an area, sampled on a grid for large areas.
+    :param pixels: The RGB numpy array of the area.
+    :return: tuple(r, g, b)
+    """
+    step = max(1, int(np.sqrt(pixels.shape[0] * pixels.shape[1] / COLOR_SAMPLES)))
+    sample = pixels[::step, ::step].reshape(-1, 3).astype(np.uint32)
+    packed = (sample[:, 0] << 16) | (sample[:, 1] << 8) | sample[:, 2]
+    values, counts = np.unique(packed, return_counts=True)
+    color = int(values[np.argmax(counts)])
+    return color >> 16, (color >> 8) & 255, color & 255
+
+
+def _overlap(a, b):
+    """
+    Returns the intersection over union of two (x, y, w, h) rectangles.
+    :return: float
+    """
+    w = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    h = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    return w * h / float(a[2] * a[3] + b[2] * b[3] - w * h)
+
+
+def _is_border(inner, outer):
+    """
+    Returns True if an (x, y, w, h) rectangle is only the inner edge of the border of another.
+    :return: bool
+    """
+    return 0 <= inner[0] - outer[0] <= BORDER and 0 <= inner[1] - outer[1] <= BORDER and \
+        0 <= outer[0] + outer[2] - inner[0] - inner[2] <= BORDER and \
+        0 <= outer[1] + outer[3] - inner[1] - inner[3] <= BORDER
+
+
+def _intersects(a, b):
+    """
+    Returns True if two (left, top, right, bottom) boxes overlap.
+    :return: bool
+    """
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _union(boxes):
+    """
+    Returns the smallest (left, top, right, bottom) box containing every box.
+    :return: tuple
+    """
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes),
+            max(b[3] for b in boxes))
+
+
+def _pad(box, bounds):
+    """
+    Grows a (left, top, right, bottom) box by PADDING pixels on every side, clipped to another.
+    :return: tuple
+    """
+    return _clip((box[0] - PADDING, box[1] - PADDING, box[2] + PADDING, box[3] + PADDING), bounds)
+
+
+def _clip(box, bounds):
+    """
+    Clips a (left, top, right, bottom) box to another.
+    :return: tuple
+    """
+    return max(box[0], bounds[0]), max(box[1], bounds[1]), min(box[2], bounds[2]), min(box[3], bounds[3])
+
+
+maps = ElementMaps()
@@ -0,0 +1,239 @@
+﻿# region License
+"""
+ * SimplRPA - A simple RPA library for Python and C#
+ *
+ * Copyright (c) 2009-2021 Ziglag the Orc
+ * Modifications (c) as per Git change history
+ *
+ * This Source Code Form is subject to the terms of the Mozilla
+ * Public License, v. 2.0. If a copy of the MPL was not distributed
+ * with this file, You can obtain one at
+ * https://mozilla.org/MPL/2.0/.
+ *
+ * The above copyright notice and this permission notice shall be included in all copies or substantial
+ * portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+ * LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ * IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+ * WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# endregion
+import os
+import json
+import time
+import zlib
+import datetime
+import threading
+import collections
+import cv2
+import _Capture_Convergence
+from _Platform_Convergence import Config
+
+EVENT_HISTORY = 256
+
+_recorder = None
+_lock = threading.Lock()
+
+
+class Recording:
+    """
+    One frame held by the flight recorder.
+    """
+    def __init__(self, timestamp, checksum, data):
+        """
+        Constructs a new Recording instance.
+        :param timestamp: The time the frame was captured.
+        :param checksum: The crc32 of the raw pixels, used to skip unchanged frames.
+        :param data: The jpeg encoded frame.
+        """
+        self.timestamp = timestamp
+        self.checksum = checksum
+        self.data = data
+
+
+class FlightRecorder(threading.Thread):
+    """
+    Keeps a bounded ring of recent jpeg encoded desktop frames in memory so the moments before a failure can be
+    dumped to disk afterwards. A frame is only encoded when the screen changed, and with damage events the screen
+    is not even captured while nothing is repainted.
+    """
+    def __init__(self):
+        """
+        Constructs a new FlightRecorder instance.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.bytes = 0
+        self.dropped = 0
+        self.suppressed = 0
+        self._last_exception_dump = None
+        self._frames = collections.deque()
+        self._events = collections.deque(maxlen=EVENT_HISTORY)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def run(self):
+        """
+        Samples the screen at Config.recorder_fps until stopped.
+        :return: void
+        """
+        tracker = _Capture_Convergence.get_tracker()
+        sequence = None
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            if tracker is None or sequence is None or tracker.dirty_since(sequence) != []:
+                sequence = tracker.sequence if tracker is not None else None
+                try:
+                    self._sample()
+                except Exception:
+                    self.dropped += 1
+            self._stopped.wait(max(0.0, 1.0 / max(0.01, float(Config.recorder_fps)) - (time.monotonic() - started)))
+
+    def stop(self):
+        """
+        Stops sampling.
+        :return: void
+        """
+        self._stopped.set()
+
+    def note(self, text):
+        """
+        Records an event, such as a request, to be dumped alongside the frames.
+        :param text: The description of the event.
+        :return: void
+        """
+        with self._lock:
+            self._events.append((time.time(), text))
+
+    def _sample(self):
+        """
+        Captures the desktop and stores it if it differs from the newest recorded frame.
+        :return: void
+        """
+        width, height = _Capture_Convergence.screen_size()
+        pixels = _Capture_Convergence.grab((0, 0, width, height))
+        checksum = zlib.crc32(pixels)
+        with self._lock:
+            if len(self._frames) > 0 and self._frames[-1].checksum == checksum:
+                return
+        ok, data = cv2.imencode('.jpg', cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR),
+                                [cv2.IMWRITE_JPEG_QUALITY, int(Config.recorder_quality)])
+        if not ok:
+            self.dropped += 1
+            return
+        recording = Recording(time.time(), checksum, data.tobytes())
+        with self._lock:
+            self._frames.append(recording)
+            self.bytes += len(recording.data)
+            while len(self._frames) > 1 and self.bytes > Config.recorder_bytes:
+                self.bytes -= len(self._frames.popleft().data)
+
+    def dump(self, folder=None, reason=''):
+        """
+        Writes the recorded frames and events to a new timestamped folder.
+        :param folder: The folder to create the dump in, defaults to Config.recorder_folder.
+        :param reason: Why the dump was taken, stored in the index.
+        :return: str path of the dump folder
+        """
+        with self._lock:
+            frames = list(self._frames)
+            events = list(self._events)
+        now = datetime.datetime.now()
+        path = os.path.join(folder or Config.recorder_folder, now.strftime('%Y-%m-%d_%H-%M-%S-%f'))
+        os.makedirs(path, exist_ok=True)
+
+        index = {"reason": reason, "frames": [], "events": [{"time": t, "text": text} for t, text in events]}
+        for i, recording in enumerate(frames):
+            name = str(i).rjust(5, '0') + '.jpg'
+            with open(os.path.join(path, name), 'wb') as f:
+                f.write(recording.data)
+            index["frames"].append({"time": recording.timestamp, "file": name})
+        with open(os.path.join(path, 'index.json'), 'w') as f:
+            json.dump(index, f, indent=2)
+        return path
+
+    def dump_exception(self, reason):
+        """
+        Dumps the recording after a failed request, unless another failure was dumped less than
+        Config.recorder_dump_interval seconds ago. A client retrying a broken call would otherwise write the whole
+        ring to disk on every attempt.
+        :param reason: The failed method and error, stored in the index.
+        :return: str path of the dump folder or None if the dump was suppressed
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._last_exception_dump is not None and \
+                    now - self._last_exception_dump < float(Config.recorder_dump_interval):
+                self.suppressed += 1
+                return None
+            self._last_exception_dump = now
+        return self.dump(reason=reason)
+
+    def stats(self):
+        """
+        Returns the recorder counters.
+        :return: dict
+        """
+        with self._lock:
+            return {"frames": len(self._frames), "bytes": self.bytes, "events": len(self._events),
+                    "dropped": self.dropped, "suppressed": self.suppressed}
+
+
+def start():
+    """
+    Starts the flight recorder if it is not running.
+    :return: FlightRecorder
+    """
+    global _recorder
+    with _lock:
+        if _recorder is None:
+            _recorder = FlightRecorder()
+            _recorder.start()
+        return _recorder
+
+
+def get_recorder():
+    """
+    Returns the running flight recorder or None if it was not started.
+    :return: FlightRecorder
+    """
+    return _recorder
+
+
+def note(text):
+    """
+    Records an event with the running flight recorder, if any.
+    :param text: The description of the event.
+    :return: void
+    """
+    recorder = _recorder
+    if recorder is not None:
+        recorder.note(text)
+
+
+def dump(folder=None, reason=''):
+    """
+    Dumps the running flight recorder to disk.
+    :param folder: The folder to create the dump in, defaults to Config.recorder_folder.
+    :param reason: Why the dump was taken, stored in the index.
+    :return: str path of the dump folder or None if the recorder is not running
+    """
+    recorder = _recorder
+    if recorder is None:
+        return None
+    return recorder.dump(folder, reason)
+
+
+def dump_exception(reason):
+    """
+    Dumps the running flight recorder to disk after a failed request, at most once per
+    Config.recorder_dump_interval seconds.
+    :param reason: The failed method and error, stored in the index.
+    :return: str path of the dump folder or None if the recorder is not running or the dump was suppressed
+    """
+    recorder = _recorder
+    if recorder is None:
+        return None
+    return recorder.dump_exception(reason)
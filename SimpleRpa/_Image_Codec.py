@@ -0,0 +1,102 @@
+﻿# region License
+"""
+ * SimplRPA - A simple RPA library for Python and C#
+ *
+ * Copyright (c) 2009-2021 Ziglag the Orc
+ * Modifications (c) as per Git change history
+ *
+ * This Source Code Form is subject to the terms of the Mozilla
+ * Public License, v. 2.0. If a copy of the MPL was not distributed
+ * with this file, You can obtain one at
+ * https://mozilla.org/MPL/2.0/.
+ *
+ * The above copyright notice and this permission notice shall be included in all copies or substantial
+ * portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+ * LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ * IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+ * WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# endregion
+import cv2
+import numpy as np
+from _Platform_Convergence import SimpleRPAException
+
+DEFAULT_QUALITY = 90
+
+
+class ImageFormats:
+    """
+    The encodings available for captured images.
+    """
+    RAW = 'raw'
+    GRAYSCALE_RAW = 'grayscale-raw'
+    PNG = 'png'
+    JPEG = 'jpeg'
+    WEBP = 'webp'
+
+
+class EncodedImage:
+    """
+    An encoded capture along with what a client needs to decode it.
+    """
+    def __init__(self, data, width, height, mode, format):
+        """
+        Constructs a new EncodedImage instance.
+        :param data: The encoded bytes.
+        :param width: The width of the encoded image.
+        :param height: The height of the encoded image.
+        :param mode: The pixel layout of the image, 'RGB' or 'L'.
+        :param format: The ImageFormats encoding of the bytes.
+        """
+        self.data = data
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.format = format
+
+
+def encode(pixels, format=ImageFormats.RAW, quality=None, scale=1):
+    """
+    Encodes an RGB capture on the calling thread, OpenCV releases the interpreter while it resizes and compresses.
+    :param pixels: The RGB numpy array to encode.
+    :param format: The ImageFormats encoding to use.
+    :param quality: The 1-100 quality for jpeg and webp, defaults to DEFAULT_QUALITY.
+    :param scale: The factor to downsample the image by before encoding, 1 keeps the original size.
+    :return: EncodedImage
+    """
+    # region Downsample.
+    scale = float(scale or 1)
+    if scale <= 0:
+        raise SimpleRPAException("scale must be greater than 0 (received '" + str(scale) + "').")
+    if scale != 1:
+        size = (max(1, int(round(pixels.shape[1] / scale))), max(1, int(round(pixels.shape[0] / scale))))
+        pixels = cv2.resize(pixels, size, interpolation=cv2.INTER_AREA if scale > 1 else cv2.INTER_LINEAR)
+    height, width = pixels.shape[:2]
+    # endregion
+
+    # region Encode.
+    format = str(format).lower()
+    quality = int(DEFAULT_QUALITY if quality is None else quality)
+    if format == ImageFormats.RAW:
+        return EncodedImage(np.ascontiguousarray(pixels).tobytes(), width, height, 'RGB', format)
+    elif format == ImageFormats.GRAYSCALE_RAW:
+        return EncodedImage(cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY).tobytes(), width, height, 'L', format)
+    elif format == ImageFormats.PNG:
+        params = []
+        ext = '.png'
+    elif format == ImageFormats.JPEG:
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        ext = '.jpg'
+    elif format == ImageFormats.WEBP:
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+        ext = '.webp'
+    else:
+        raise SimpleRPAException("Unknown image format '" + format + "'.")
+    ok, data = cv2.imencode(ext, cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR), params)
+    if not ok:
+        raise SimpleRPAException("Unable to encode the image as " + format + ".")
+    return EncodedImage(data.tobytes(), width, height, 'RGB', format)
+    # endregion
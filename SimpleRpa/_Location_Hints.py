@@ -0,0 +1,111 @@
+﻿# region License
+"""
+ * SimplRPA - A simple RPA library for Python and C#
+ *
+ * Copyright (c) 2009-2021 Ziglag the Orc
+ * Modifications (c) as per Git change history
+ *
+ * This Source Code Form is subject to the terms of the Mozilla
+ * Public License, v. 2.0. If a copy of the MPL was not distributed
+ * with this file, You can obtain one at
+ * https://mozilla.org/MPL/2.0/.
+ *
+ * The above copyright notice and this permission notice shall be included in all copies or substantial
+ * portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+ * LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ * IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+ * WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# endregion
+import threading
+import collections
+from _Platform_Convergence import Config
+
+
+class LocationHints:
+    """
+    A least recently used record of where each needle was last found, so the next search can look there first. Hints
+    are kept per searched area and remember the threshold they were found with, a search only covers the matches of
+    its own area at or above its own threshold. They also remember the tile hashes of the area, a hint says nothing
+    about tiles that changed away from the locations.
+    """
+    def __init__(self):
+        """
+        Constructs a new LocationHints instance.
+        """
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, threshold):
+        """
+        Returns the locations the needle was last found at by a search of the same area. A hint found with a higher
+        threshold is not returned, a lower threshold may match locations the hint never saw.
+        :param key: The (path, signature, bounds) of the needle and the searched area.
+        :param threshold: The matching threshold of the search.
+        :return: tuple(tuple(x,y,w,h)[], tile hashes of the area) or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or threshold < entry[0]:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def record(self, key, threshold, rects, hashes):
+        """
+        Stores the locations a search found. Searches that found more locations than Config.hint_locations are
+        forgotten, a hint must be able to reproduce the complete answer.
+        :param key: The (path, signature, bounds) of the needle and the searched area.
+        :param threshold: The matching threshold the locations were found with.
+        :param rects: The (x, y, w, h) locations found.
+        :param hashes: The tile hashes of the area the locations were found in.
+        :return: void
+        """
+        with self._lock:
+            if len(rects) == 0:
+                return
+            if len(rects) > Config.hint_locations:
+                self._entries.pop(key, None)
+                return
+            self._entries[key] = (threshold, [tuple(r[:4]) for r in rects], hashes)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max(1, int(Config.hint_entries)):
+                self._entries.popitem(last=False)
+
+    def count(self, hit):
+        """
+        Counts a lookup.
+        :param hit: True if the hinted locations answered the search.
+        :return: void
+        """
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def clear(self):
+        """
+        Forgets every location.
+        :return: void
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the hint counters.
+        :return: dict
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": 0.0 if lookups == 0 else self.hits / lookups}
+
+
+hints = LocationHints()
@@ -0,0 +1,216 @@
+﻿# region License
+"""
+ * SimplRPA - A simple RPA library for Python and C#
+ *
+ * Copyright (c) 2009-2021 Ziglag the Orc
+ * Modifications (c) as per Git change history
+ *
+ * This Source Code Form is subject to the terms of the Mozilla
+ * Public License, v. 2.0. If a copy of the MPL was not distributed
+ * with this file, You can obtain one at
+ * https://mozilla.org/MPL/2.0/.
+ *
+ * The above copyright notice and this permission notice shall be included in all copies or substantial
+ * portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+ * LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ * IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+ * WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# endregion
+import os
+import threading
+import collections
+import cv2
+import numpy as np
+from _Platform_Convergence import Config, SimpleRPAException
+
+ORB_PATCH_SIZE = 15
+
+
+def create_orb(features):
+    """
+    Creates the ORB detector used for needles and for the screen alike, descriptors only compare when they were
+    computed with the same patch size. The patch is smaller than the ORB default so icon sized needles still yield
+    keypoints.
+    :param features: The maximum number of keypoints to keep.
+    :return: cv2.ORB
+    """
+    return cv2.ORB_create(nfeatures=int(features), edgeThreshold=ORB_PATCH_SIZE, patchSize=ORB_PATCH_SIZE)
+
+
+class Needle:
+    """
+    A decoded reference image ready to be searched for on the screen.
+    """
+    def __init__(self, path, signature, image, mask=None):
+        """
+        Constructs a new Needle instance.
+        :param path: The file the needle was loaded from.
+        :param signature: The (mtime, size) of the file when it was loaded.
+        :param image: The grayscale numpy array of the needle.
+        :param mask: Optional uint8 numpy array derived from the alpha channel, transparent pixels are 0.
+        """
+        image.flags.writeable = False
+        if mask is not None:
+            mask.flags.writeable = False
+        self.path = path
+        self.signature = signature
+        self.image = image
+        self.mask = mask
+        self.height, self.width = image.shape[:2]
+        # Normalized correlation scores a flat needle 1.0 everywhere, find_images rejects those up front.
+        self.std = float(cv2.meanStdDev(image, mask=mask)[1][0][0])
+        self._features = None
+
+    def features(self):
+        """
+        Returns the ORB keypoint positions and descriptors of the needle, detecting them on first use only. The needle
+        is padded by its edge pixels first, otherwise ORB ignores every keypoint within a patch of its border.
+        :return: tuple(float32 numpy array of (x, y) positions, descriptors)
+        """
+        if self._features is None:
+            pad = ORB_PATCH_SIZE
+            image = cv2.copyMakeBorder(self.image, pad, pad, pad, pad, cv2.BORDER_REPLICATE)
+            mask = np.zeros(image.shape, dtype=np.uint8)
+            mask[pad:pad + self.height, pad:pad + self.width] = 255 if self.mask is None else self.mask
+            keypoints, descriptors = create_orb(Config.orb_needle_features).detectAndCompute(image, mask)
+            points = np.float32([kp.pt for kp in keypoints]).reshape(-1, 2) - pad
+            self._features = (points, descriptors)
+        return self._features
+
+    @property
+    def nbytes(self):
+        """
+        The number of bytes the cached needle occupies.
+        :return: int
+        """
+        return self.image.nbytes + (0 if self.mask is None else self.mask.nbytes)
+
+
+class NeedleCache:
+    """
+    A least recently used cache of decoded needles keyed by path. Entries are invalidated when the modification time
+    or size of the file changes.
+    """
+    def __init__(self):
+        """
+        Constructs a new NeedleCache instance.
+        """
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, path):
+        """
+        Returns the needle for the specified file, decoding it only if it is not cached or has changed on disk.
+        :param path: The name of the image file.
+        :return: Needle
+        """
+        if path is None or path == '':
+            raise FileNotFoundError("The paramater 'file' must be populated.")
+        st = os.stat(path)
+        signature = (st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            needle = self._entries.get(path)
+            if needle is not None:
+                if needle.signature == signature:
+                    self._entries.move_to_end(path)
+                    self.hits += 1
+                    return needle
+                self._remove(path)
+                self.invalidations += 1
+            self.misses += 1
+
+        needle = self._load(path, signature)
+
+        with self._lock:
+            if path in self._entries:
+                self._remove(path)
+            self._entries[path] = needle
+            self.bytes += needle.nbytes
+            self._trim()
+        return needle
+
+    def clear(self):
+        """
+        Drops every cached needle.
+        :return: void
+        """
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """
+        Returns the cache counters.
+        :return: dict
+        """
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.bytes, "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "invalidations": self.invalidations}
+
+    def _load(self, path, signature):
+        """
+        Decodes the image file into a grayscale needle. An alpha channel becomes the match mask of the needle, fully
+        opaque images are matched without one.
+        :param path: The name of the image file.
+        :param signature: The (mtime, size) of the file.
+        :return: Needle
+        """
+        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise FileNotFoundError("Unable to read image file '" + path + "'.")
+        if img.dtype == np.uint16:
+            img = cv2.convertScaleAbs(img, alpha=255.0 / 65535)
+
+        # region Split off the alpha channel.
+        mask = None
+        if img.ndim == 2:
+            gray = img
+        elif img.shape[2] == 4:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
+            alpha = img[:, :, 3]
+            if cv2.countNonZero(alpha) == 0:
+                raise SimpleRPAException("The image file '" + path + "' is fully transparent.")
+            if cv2.countNonZero(alpha) < alpha.size or alpha.min() < 255:
+                # Blended edge pixels depend on the background, so only fully opaque pixels are compared unless
+                # the whole image is translucent.
+                mask = np.where(alpha == 255, 255, 0).astype(np.uint8)
+                if cv2.countNonZero(mask) == 0:
+                    mask = np.where(alpha > 0, 255, 0).astype(np.uint8)
+        else:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # endregion
+
+        return Needle(path, signature, gray, mask)
+
+    def _remove(self, path):
+        """
+        Removes an entry. The caller must hold the lock.
+        :param path: The key of the entry to remove.
+        :return: void
+        """
+        needle = self._entries.pop(path)
+        self.bytes -= needle.nbytes
+
+    def _trim(self):
+        """
+        Evicts the least recently used needles until the cache fits its entry and byte limits. The most recent entry
+        is always kept. The caller must hold the lock.
+        :return: void
+        """
+        while len(self._entries) > 1 and (len(self._entries) > Config.needle_cache_entries or
+                                          self.bytes > Config.needle_cache_bytes):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+
+needles = NeedleCache()
@@ -33,6 +33,7 @@ import os
 import platform
 import re
 import functools
+import threading
 import collections.abc
 
 import pytweening
@@ -581,6 +582,44 @@ else:
     raise NotImplementedError("Your platform (%s) is not supported by SimpleRPA." % (platform.system()))
 # endregion
 
+# region INPUT GENERATION
+# Bumped every time input is injected so cached screen frames can tell they may be stale.
+input_generation = 0
+_input_generation_lock = threading.Lock()
+
+
+def _bump_input_generation():
+    """
+    Advances the input generation counter. Called after every mouse or keyboard event sent to the operating system.
+    :return: void
+    """
+    global input_generation
+    with _input_generation_lock:
+        input_generation += 1
+
+
+def _tracks_input(injector):
+    """
+    A decorator that bumps the input generation once the wrapped platform injector has run.
+    :param injector: The platform specific mouse or keyboard function.
+    :return: function
+    """
+    @functools.wraps(injector)
+    def wrapper(*args, **kwargs):
+        try:
+            return injector(*args, **kwargs)
+        finally:
+            _bump_input_generation()
+
+    return wrapper
+
+
+for _injector in ('_move_to', '_drag_to', '_mouse_down', '_mouse_up', '_click', '_multiClick', '_scroll', '_key_down',
+                  '_key_up'):
+    if hasattr(platformModule, _injector):
+        setattr(platformModule, _injector, _tracks_input(getattr(platformModule, _injector)))
+# endregion
+
 # region TWEAKABLE SETTINGS
 # In seconds. Any duration less than this is rounded to 0.0 to instantly move the mouse.
 MINIMUM_DURATION = 0.1
@@ -1844,4 +1883,52 @@ class Config:
     port = 0
     protocol = ""
     run_as_a_service = True
+    capture_backend = "auto"
+    frame_history = 4
+    change_detection = "auto"
+    change_poll_interval = 0.1
+    needle_cache_entries = 256
+    needle_cache_bytes = 64 * 1024 * 1024
+    pyramid_levels = [4, 2]
+    pyramid_refine_window = 2
+    pyramid_tolerance = 0.15
+    suppress_overlapping_matches = True
+    match_overlap = 0.3
+    worker_threads = 0
+    wait_backoff_min = 0.05
+    wait_backoff_max = 1.0
+    stream_tile_size = 64
+    stream_keyframe_interval = 300
+    stream_history = 16
+    capture_buffers = 4
+    recorder_enabled = False
+    recorder_fps = 2
+    recorder_quality = 70
+    recorder_bytes = 32 * 1024 * 1024
+    recorder_folder = "flight_recorder"
+    recorder_dump_on_exception = True
+    recorder_dump_interval = 60
+    orb_needle_features = 500
+    orb_scene_features = 5000
+    orb_ratio = 0.75
+    orb_min_matches = 6
+    location_hints = True
+    hint_locations = 4
+    hint_margin = 8
+    hint_entries = 1024
+    result_cache = True
+    result_cache_entries = 256
+    tile_index_size = 64
+    regions = dict()
+    element_min_size = 8
+    element_map_entries = 16
+    diff_threshold = 16
+    diff_merge_distance = 8
+    video_fps = 5
+    video_queue_frames = 30
+    video_encoder = "auto"
+    video_ffmpeg = "ffmpeg"
+    video_fourcc = "MJPG"
+    video_extension = ".avi"
+    video_folder = "videos"
 # endregion
@@ -0,0 +1,172 @@
+﻿# region License
+"""
+ * SimplRPA - A simple RPA library for Python and C#
+ *
+ * Copyright (c) 2009-2021 Ziglag the Orc
+ * Modifications (c) as per Git change history
+ *
+ * This Source Code Form is subject to the terms of the Mozilla
+ * Public License, v. 2.0. If a copy of the MPL was not distributed
+ * with this file, You can obtain one at
+ * https://mozilla.org/MPL/2.0/.
+ *
+ * The above copyright notice and this permission notice shall be included in all copies or substantial
+ * portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+ * LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ * IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+ * WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# endregion
+import threading
+import _Platform_Convergence as pc
+from _Platform_Convergence import Config, SimpleRPAException
+
+
+class NamedRegion:
+    """
+    A named area of the screen. Anchored regions are placed relative to the top left corner of an anchor image, the
+    others relative to the desktop or to their monitor.
+    """
+    def __init__(self, name, x, y, width, height, anchor=None, threshold=0.9, search=None, monitor=None):
+        """
+        Constructs a new NamedRegion instance.
+        :param name: The name the region is looked up by.
+        :param x: The left of the region relative to its anchor, monitor or the desktop.
+        :param y: The top of the region relative to its anchor, monitor or the desktop.
+        :param width: The width of the region.
+        :param height: The height of the region.
+        :param anchor: Optional name of the image file the region is anchored to.
+        :param threshold: The matching threshold used to find the anchor.
+        :param search: Optional tuple area rectangle (x, y, w, h) the anchor is searched in.
+        :param monitor: Optional index or name of the monitor the region or anchor search is relative to.
+        """
+        self.name = name
+        self.x = int(x)
+        self.y = int(y)
+        self.width = int(width)
+        self.height = int(height)
+        self.anchor = anchor
+        self.threshold = float(threshold)
+        self.search = None if search is None else tuple(int(v) for v in search[:4])
+        self.monitor = monitor
+
+
+class RegionRegistry:
+    """
+    The named regions known to the server along with where each one was last resolved to. A resolution is reused until
+    input is injected, so the anchor of a region is searched for at most once per input generation.
+    """
+    def __init__(self):
+        """
+        Constructs a new RegionRegistry instance.
+        """
+        self._regions = dict()
+        self._resolved = dict()
+        self._lock = threading.Lock()
+        self._configured = False
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, region):
+        """
+        Adds a region, replacing any region of the same name.
+        :param region: The NamedRegion to add.
+        :return: void
+        """
+        with self._lock:
+            self._configure()
+            self._regions[region.name] = region
+            self._resolved.pop(region.name, None)
+
+    def unregister(self, name):
+        """
+        Removes a region.
+        :param name: The name of the region to remove.
+        :return: bool True if the region existed.
+        """
+        with self._lock:
+            self._configure()
+            self._resolved.pop(name, None)
+            return self._regions.pop(name, None) is not None
+
+    def get(self, name):
+        """
+        Returns a region along with its resolution if it is still valid for the current input generation.
+        :param name: The name of the region.
+        :return: tuple(NamedRegion, tuple(x,y,w,h) or None, input generation)
+        """
+        with self._lock:
+            self._configure()
+            region = self._regions.get(name)
+            if region is None:
+                raise SimpleRPAException("Unknown region '" + str(name) + "'.")
+            generation = pc.input_generation
+            resolved = self._resolved.get(name)
+            if resolved is not None and resolved[0] == generation:
+                self.hits += 1
+                return region, resolved[1], generation
+            self.misses += 1
+            return region, None, generation
+
+    def store(self, name, generation, rect):
+        """
+        Remembers where a region was resolved to.
+        :param name: The name of the region.
+        :param generation: The input generation the region was resolved in.
+        :param rect: The (x, y, w, h) desktop area of the region.
+        :return: void
+        """
+        with self._lock:
+            if name in self._regions:
+                self._resolved[name] = (generation, rect)
+
+    def names(self):
+        """
+        Returns the names of the registered regions.
+        :return: str[]
+        """
+        with self._lock:
+            self._configure()
+            return sorted(self._regions)
+
+    def stats(self):
+        """
+        Returns the registry counters.
+        :return: dict
+        """
+        with self._lock:
+            return {"entries": len(self._regions), "resolved": len(self._resolved), "hits": self.hits,
+                    "misses": self.misses}
+
+    def _configure(self):
+        """
+        Registers the regions of the config file on first use. The caller must hold the lock.
+        :return: void
+        """
+        if self._configured:
+            return
+        self._configured = True
+        for name, rgn in (Config.regions or dict()).items():
+            if name not in self._regions:
+                self._regions[name] = from_json(name, rgn)
+
+
+def from_json(name, rgn):
+    """
+    Creates a region from its json description.
+    :param name: The name of the region.
+    :param rgn: A {"x":0,"y":0,"width":0,"height":0} object with optional "anchor", "threshold", "search" and
+    "monitor" members. The search area is given as {"x":0,"y":0,"width":0,"height":0} or [x, y, w, h].
+    :return: NamedRegion
+    """
+    search = rgn.get('search')
+    if isinstance(search, dict):
+        search = (search['x'], search['y'], search['width'], search['height'])
+    return NamedRegion(name, rgn['x'], rgn['y'], rgn['width'], rgn['height'], rgn.get('anchor'),
+                       rgn.get('threshold', 0.9), search, rgn.get('monitor'))
+
+
+regions = RegionRegistry()
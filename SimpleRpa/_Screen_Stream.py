@@ -0,0 +1,150 @@
+﻿# region License
+"""
+ * SimplRPA - A simple RPA library for Python and C#
+ *
+ * Copyright (c) 2009-2021 Ziglag the Orc
+ * Modifications (c) as per Git change history
+ *
+ * This Source Code Form is subject to the terms of the Mozilla
+ * Public License, v. 2.0. If a copy of the MPL was not distributed
+ * with this file, You can obtain one at
+ * https://mozilla.org/MPL/2.0/.
+ *
+ * The above copyright notice and this permission notice shall be included in all copies or substantial
+ * portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+ * LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ * IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+ * WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# endregion
+import time
+import uuid
+import threading
+import collections
+import numpy as np
+import _Capture_Convergence
+import _Tile_Index
+from _Platform_Convergence import Config
+
+IDLE_TIMEOUT = 300
+
+_streams = dict()
+_lock = threading.Lock()
+
+
+class StreamFrame:
+    """
+    One frame of a tile delta stream. The payload holds the raw RGB bytes of every sent tile in the order listed in
+    tiles, tiles on the right and bottom edges are cropped to the captured area.
+    """
+    def __init__(self, frame, keyframe, width, height, tile_size, tiles, payload):
+        """
+        Constructs a new StreamFrame instance.
+        :param frame: The sequence number of this frame within the stream.
+        :param keyframe: True if every tile was sent.
+        :param width: The width of the streamed area.
+        :param height: The height of the streamed area.
+        :param tile_size: The width and height of a tile.
+        :param tiles: The row major indexes of the tiles in the payload.
+        :param payload: The bytes of the sent tiles.
+        """
+        self.frame = frame
+        self.keyframe = keyframe
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.tiles = tiles
+        self.payload = payload
+
+
+class ScreenStream:
+    """
+    Streams an area of the screen as tile deltas. Each frame only carries the tiles that differ from the last frame
+    the client acknowledged, a full keyframe is sent when the acknowledged frame is unknown or the keyframe interval
+    has passed.
+    """
+    def __init__(self, stream_id, bbox):
+        """
+        Constructs a new ScreenStream instance.
+        :param stream_id: The id clients use to continue the stream.
+        :param bbox: The (left, top, right, bottom) area of the screen to stream.
+        """
+        self.stream_id = stream_id
+        self.bbox = bbox
+        self.tile_size = int(Config.stream_tile_size)
+        self.sequence = 0
+        self.last_keyframe = 0
+        self.last_used = time.monotonic()
+        self._hashes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def next_frame(self, ack=None):
+        """
+        Captures the next frame of the stream.
+        :param ack: The sequence number of the last frame the client received or None.
+        :return: StreamFrame
+        """
+        with self._lock:
+            self.last_used = time.monotonic()
+            pixels = _Capture_Convergence.grab(self.bbox)
+            height, width = pixels.shape[:2]
+            hashes = _Tile_Index.hash_tiles(pixels, self.tile_size)
+
+            # region Pick the tiles that differ from the acknowledged frame.
+            self.sequence += 1
+            reference = self._hashes.get(ack) if ack is not None else None
+            keyframe = reference is None or reference.shape != hashes.shape or \
+                self.sequence - self.last_keyframe >= int(Config.stream_keyframe_interval)
+            if keyframe:
+                self.last_keyframe = self.sequence
+                tiles = np.arange(hashes.size)
+            else:
+                tiles = np.flatnonzero(hashes != reference)
+            # endregion
+
+            # region Remember the hashes of this frame for later acknowledgements.
+            self._hashes[self.sequence] = hashes
+            while len(self._hashes) > max(1, int(Config.stream_history)):
+                self._hashes.popitem(last=False)
+            # endregion
+
+            # region Pack the tiles.
+            size = self.tile_size
+            cols = hashes.shape[1]
+            payload = b''.join(pixels[(t // cols) * size:(t // cols + 1) * size,
+                                      (t % cols) * size:(t % cols + 1) * size].tobytes() for t in tiles)
+            # endregion
+
+            return StreamFrame(self.sequence, keyframe, width, height, size, [int(t) for t in tiles], payload)
+
+
+def get_stream(stream_id, bbox):
+    """
+    Returns the stream with the specified id, or a new stream if the id is unknown or the area has changed. Streams
+    that have not been used for IDLE_TIMEOUT seconds are dropped.
+    :param stream_id: The id of the stream to continue or None to start a new one.
+    :param bbox: The (left, top, right, bottom) area of the screen to stream.
+    :return: ScreenStream
+    """
+    with _lock:
+        now = time.monotonic()
+        for key in [key for key, stream in _streams.items() if now - stream.last_used > IDLE_TIMEOUT]:
+            del _streams[key]
+        stream = _streams.get(stream_id)
+        if stream is None or stream.bbox != bbox or stream.tile_size != int(Config.stream_tile_size):
+            stream = ScreenStream(stream_id or uuid.uuid4().hex, bbox)
+            _streams[stream.stream_id] = stream
+        return stream
+
+
+def close_stream(stream_id):
+    """
+    Drops the stream with the specified id.
+    :param stream_id: The id of the stream to close.
+    :return: void
+    """
+    with _lock:
+        _streams.pop(stream_id, None)
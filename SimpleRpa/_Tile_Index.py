@@ -0,0 +1,204 @@
+﻿# region License
+"""
+ * SimplRPA - A simple RPA library for Python and C#
+ *
+ * Copyright (c) 2009-2021 Ziglag the Orc
+ * Modifications (c) as per Git change history
+ *
+ * This Source Code Form is subject to the terms of the Mozilla
+ * Public License, v. 2.0. If a copy of the MPL was not distributed
+ * with this file, You can obtain one at
+ * https://mozilla.org/MPL/2.0/.
+ *
+ * The above copyright notice and this permission notice shall be included in all copies or substantial
+ * portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+ * LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ * IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+ * WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# endregion
+import zlib
+import threading
+import collections
+import numpy as np
+import _Capture_Convergence
+from _Platform_Convergence import Config
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def _hash(buffer):
+    """
+    Hashes the bytes of a tile with xxhash when it is installed and crc32 otherwise.
+    :param buffer: The contiguous buffer to hash.
+    :return: int
+    """
+    if xxhash is not None:
+        return xxhash.xxh3_64_intdigest(buffer)
+    return zlib.crc32(buffer)
+
+
+def hash_tiles(pixels, size):
+    """
+    Hashes every tile of a capture split along a grid, tiles along the right and bottom edge may be partial.
+    :param pixels: The RGB numpy array of the capture.
+    :param size: The width and height of a tile.
+    :return: numpy.array of the tile hashes shaped (rows, cols)
+    """
+    rows = -(-pixels.shape[0] // size)
+    cols = -(-pixels.shape[1] // size)
+    hashes = np.zeros((rows, cols), dtype=np.uint64)
+    for r in range(rows):
+        band = pixels[r * size:(r + 1) * size]
+        for c in range(cols):
+            hashes[r, c] = _hash(np.ascontiguousarray(band[:, c * size:(c + 1) * size]))
+    return hashes
+
+
+class TileIndex:
+    """
+    Splits captures along a fixed desktop grid and hashes each tile, so cached answers can be checked against the tiles
+    they were computed from.
+    """
+    def __init__(self):
+        """
+        Constructs a new TileIndex instance.
+        """
+        self._tile_size = None
+
+    @property
+    def tile_size(self):
+        """
+        The width and height of a tile, read on first use since the config is loaded after this module is imported.
+        :return: int
+        """
+        if self._tile_size is None:
+            self._tile_size = max(1, int(Config.tile_index_size))
+        return self._tile_size
+
+    def align(self, bbox):
+        """
+        Grows a bounding box to the tile grid, tiles along the right and bottom edge of the screen may be partial.
+        :param bbox: The (left, top, right, bottom) tuple to grow.
+        :return: tuple(left, top, right, bottom)
+        """
+        size = self.tile_size
+        width, height = _Capture_Convergence.screen_size()
+        return (max(0, bbox[0] // size * size), max(0, bbox[1] // size * size),
+                min(width, -(-bbox[2] // size) * size), min(height, -(-bbox[3] // size) * size))
+
+    def tiles(self, aligned):
+        """
+        Returns the tiles of a tile aligned area in the order their hashes are reported.
+        :param aligned: The (left, top, right, bottom) tile aligned area.
+        :return: tuple(left, top, right, bottom)[]
+        """
+        size = self.tile_size
+        return [(x, y, min(x + size, aligned[2]), min(y + size, aligned[3]))
+                for y in range(aligned[1], aligned[3], size) for x in range(aligned[0], aligned[2], size)]
+
+    def hash(self, pixels):
+        """
+        Hashes every tile of a tile aligned capture.
+        :param pixels: The RGB numpy array of the capture.
+        :return: tuple of the tile hashes in row major order
+        """
+        return tuple(hash_tiles(pixels, self.tile_size).ravel().tolist())
+
+    def stats(self):
+        """
+        Returns the index settings.
+        :return: dict
+        """
+        return {"tile_size": self.tile_size, "hasher": "xxhash" if xxhash is not None else "crc32"}
+
+
+class ResultCache:
+    """
+    A least recently used memo of find_image and OCR answers keyed by the call and valid only while the hashes of the
+    tiles the call covered are unchanged.
+    """
+    def __init__(self):
+        """
+        Constructs a new ResultCache instance.
+        """
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, hashes):
+        """
+        Looks up the answer of a call.
+        :param key: The hashable description of the call.
+        :param hashes: The tile hashes of the area the call covers now.
+        :return: tuple(found, result)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == hashes:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, hashes, result):
+        """
+        Stores the answer of a call.
+        :param key: The hashable description of the call.
+        :param hashes: The tile hashes of the area the call covered.
+        :param result: The answer to memoize.
+        :return: void
+        """
+        with self._lock:
+            self._entries[key] = (hashes, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max(1, int(Config.result_cache_entries)):
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drops every memoized answer.
+        :return: void
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache counters.
+        :return: dict
+        """
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+index = TileIndex()
+results = ResultCache()
+
+
+def grab(bbox):
+    """
+    Captures an area of the screen grown to the tile grid and hashes its tiles.
+    :param bbox: The (left, top, right, bottom) tuple to capture.
+    :return: tuple(pixels of bbox, tile hashes)
+    """
+    aligned = index.align(bbox)
+    pixels = _Capture_Convergence.grab(aligned)
+    hashes = index.hash(pixels)
+    return pixels[bbox[1] - aligned[1]:bbox[3] - aligned[1], bbox[0] - aligned[0]:bbox[2] - aligned[0]], hashes
+
+
+def stats():
+    """
+    Returns the counters of the tile index and result cache.
+    :return: dict
+    """
+    return {"tiles": index.stats(), "results": results.stats()}
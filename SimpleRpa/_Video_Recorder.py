@@ -0,0 +1,283 @@
+﻿# region License
+"""
+ * SimplRPA - A simple RPA library for Python and C#
+ *
+ * Copyright (c) 2009-2021 Ziglag the Orc
+ * Modifications (c) as per Git change history
+ *
+ * This Source Code Form is subject to the terms of the Mozilla
+ * Public License, v. 2.0. If a copy of the MPL was not distributed
+ * with this file, You can obtain one at
+ * https://mozilla.org/MPL/2.0/.
+ *
+ * The above copyright notice and this permission notice shall be included in all copies or substantial
+ * portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+ * LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ * IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+ * WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# endregion
+import os
+import time
+import queue
+import shutil
+import datetime
+import threading
+import subprocess
+import cv2
+import numpy as np
+import _Capture_Convergence
+from _Platform_Convergence import Config, SimpleRPAException
+
+_recorder = None
+_lock = threading.Lock()
+
+
+class VideoEncoders:
+    """
+    The encoders a session video can be written with.
+    """
+    AUTO = 'auto'
+    FFMPEG = 'ffmpeg'
+    OPENCV = 'opencv'
+
+
+class VideoRecorder:
+    """
+    Records the desktop to a video file. A sampling thread captures frames at a fixed rate into a bounded queue and a
+    second thread encodes them, either by piping raw frames to an ffmpeg process or with an OpenCV VideoWriter. When
+    the encoder falls behind frames are dropped rather than blocking the sampler or the bot. The encoders write at a
+    constant rate, so the last frame is written again for every dropped tick and the video keeps to wall-clock time.
+    """
+    def __init__(self, path, fps, encoder):
+        """
+        Constructs a new VideoRecorder instance.
+        :param path: The video file to write.
+        :param fps: The number of frames to capture per second.
+        :param encoder: The VideoEncoders value to write with.
+        """
+        width, height = _Capture_Convergence.screen_size()
+        self.path = path
+        self.fps = float(fps)
+        self.size = (int(width), int(height))
+        self.encoder = _resolve_encoder(encoder)
+        self.frames = 0
+        self.dropped = 0
+        self.repeated = 0
+        self.error = None
+        self._started = None
+        self._finished = None
+        self._sink = None
+        self._queue = queue.Queue(maxsize=max(1, int(Config.video_queue_frames)))
+        self._stopped = threading.Event()
+        self._gap = 0
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._writer = threading.Thread(target=self._encode, daemon=True)
+
+    def start(self):
+        """
+        Starts sampling and encoding.
+        :return: void
+        """
+        folder = os.path.dirname(self.path)
+        if folder != '':
+            os.makedirs(folder, exist_ok=True)
+        self._sink = self._open()
+        self._started = time.monotonic()
+        self._writer.start()
+        self._sampler.start()
+
+    def stop(self):
+        """
+        Stops sampling, waits for the queued frames to be encoded and closes the file.
+        :return: dict of the final counters
+        """
+        self._stopped.set()
+        self._sampler.join()
+        self._queue.put((None, self._gap))
+        self._writer.join()
+        self._finished = time.monotonic()
+        return self.stats()
+
+    def stats(self):
+        """
+        Returns the recorder counters.
+        :return: dict
+        """
+        return {"path": self.path, "encoder": self.encoder, "fps": self.fps, "frames": self.frames,
+                "dropped": self.dropped, "repeated": self.repeated, "queued": self._queue.qsize(), "error": self.error,
+                "seconds": 0.0 if self._started is None else (self._finished or time.monotonic()) - self._started}
+
+    def _sample(self):
+        """
+        Captures the desktop at the recording rate until stopped. Frames that do not fit in the queue are dropped, each
+        queued frame carries the number of ticks dropped since the previous one.
+        :return: void
+        """
+        interval = 1.0 / max(0.01, self.fps)
+        due = time.monotonic()
+        while not self._stopped.is_set():
+            try:
+                pixels = _Capture_Convergence.grab((0, 0, self.size[0], self.size[1]))
+                if pixels.shape[1] != self.size[0] or pixels.shape[0] != self.size[1]:
+                    raise SimpleRPAException("The screen size changed while recording.")
+                # The capture is a pooled buffer, the queue keeps a copy.
+                self._queue.put_nowait((np.array(pixels), self._gap))
+                self._gap = 0
+            except queue.Full:
+                self.dropped += 1
+                self._gap += 1
+            except Exception:
+                self.dropped += 1
+                self._gap += 1
+
+            # Keep to the fixed rate, skipping the ticks a slow capture overran.
+            due += interval
+            now = time.monotonic()
+            if due < now:
+                skipped = int((now - due) / interval + 1)
+                self.dropped += skipped
+                self._gap += skipped
+                due += skipped * interval
+            self._stopped.wait(due - now)
+
+    def _encode(self):
+        """
+        Writes queued frames to the video until the end of the queue is reached. The previous frame is written again
+        for the ticks dropped before each frame, and for those dropped before the recording stopped.
+        :return: void
+        """
+        sink = self._sink
+        last = None
+        try:
+            while True:
+                pixels, gap = self._queue.get()
+                if self.error is None:
+                    try:
+                        frame = None if pixels is None else self._convert(pixels)
+                        # Hold the previous frame over the dropped ticks, or the first one if none was written yet.
+                        held = last if last is not None else frame
+                        for i in range(gap if held is not None else 0):
+                            self._write(sink, held)
+                            self.repeated += 1
+                        if frame is not None:
+                            self._write(sink, frame)
+                            last = frame
+                    except Exception as e:
+                        self.error = str(e)
+                        self.dropped += 1
+                elif pixels is not None:
+                    self.dropped += 1
+                if pixels is None:
+                    break
+        finally:
+            if self.encoder == VideoEncoders.FFMPEG:
+                try:
+                    sink.stdin.close()
+                except Exception:
+                    pass
+                sink.wait()
+            else:
+                sink.release()
+
+    def _convert(self, pixels):
+        """
+        Converts a captured frame to what the encoder takes.
+        :param pixels: The RGB numpy array of the frame.
+        :return: bytes for ffmpeg or a BGR numpy array for OpenCV
+        """
+        if self.encoder == VideoEncoders.FFMPEG:
+            return pixels.tobytes()
+        return cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR)
+
+    def _write(self, sink, frame):
+        """
+        Writes one converted frame to the encoder.
+        :param sink: The subprocess.Popen or cv2.VideoWriter returned by _open.
+        :param frame: The frame returned by _convert.
+        :return: void
+        """
+        if self.encoder == VideoEncoders.FFMPEG:
+            sink.stdin.write(frame)
+        else:
+            sink.write(frame)
+        self.frames += 1
+
+    def _open(self):
+        """
+        Opens the encoder.
+        :return: subprocess.Popen or cv2.VideoWriter
+        """
+        width, height = self.size
+        if self.encoder == VideoEncoders.FFMPEG:
+            return subprocess.Popen([shutil.which(Config.video_ffmpeg), '-y', '-loglevel', 'error', '-f', 'rawvideo',
+                                     '-pix_fmt', 'rgb24', '-s', str(width) + 'x' + str(height), '-r', str(self.fps),
+                                     '-i', '-', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-c:v', 'libx264',
+                                     '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', self.path],
+                                    stdin=subprocess.PIPE)
+        writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*Config.video_fourcc), self.fps, (width, height))
+        if not writer.isOpened():
+            raise SimpleRPAException("Unable to open video file '" + self.path + "' for writing.")
+        return writer
+
+
+def _resolve_encoder(encoder):
+    """
+    Picks the encoder to use. ffmpeg is preferred when it is installed.
+    :param encoder: The requested VideoEncoders value.
+    :return: str
+    """
+    if encoder == VideoEncoders.AUTO:
+        return VideoEncoders.FFMPEG if shutil.which(Config.video_ffmpeg) is not None else VideoEncoders.OPENCV
+    if encoder == VideoEncoders.FFMPEG and shutil.which(Config.video_ffmpeg) is None:
+        raise SimpleRPAException("The video encoder '" + str(Config.video_ffmpeg) + "' was not found.")
+    if encoder not in (VideoEncoders.FFMPEG, VideoEncoders.OPENCV):
+        raise SimpleRPAException("Unknown video encoder '" + str(encoder) + "'.")
+    return encoder
+
+
+def start(path=None, fps=None, encoder=None):
+    """
+    Starts recording the session to a video file. Only one recording runs at a time.
+    :param path: The video file to write, defaults to a timestamped file in Config.video_folder.
+    :param fps: The number of frames to capture per second, defaults to Config.video_fps.
+    :param encoder: The VideoEncoders value to write with, defaults to Config.video_encoder.
+    :return: VideoRecorder
+    """
+    global _recorder
+    with _lock:
+        if _recorder is not None:
+            raise SimpleRPAException("A video is already being recorded to '" + _recorder.path + "'.")
+        encoder = _resolve_encoder(encoder or Config.video_encoder)
+        if path is None:
+            ext = '.mp4' if encoder == VideoEncoders.FFMPEG else Config.video_extension
+            path = os.path.join(Config.video_folder, datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + ext)
+        recorder = VideoRecorder(path, fps or Config.video_fps, encoder)
+        recorder.start()
+        _recorder = recorder
+        return recorder
+
+
+def stop():
+    """
+    Stops the running recording.
+    :return: dict of the final counters or None if nothing was being recorded
+    """
+    global _recorder
+    with _lock:
+        recorder = _recorder
+        _recorder = None
+    if recorder is None:
+        return None
+    return recorder.stop()
+
+
+def get_recorder():
+    """
+    Returns the running video recorder or None if nothing is being recorded.
+    :return: VideoRecorder
+    """
+    return _recorder
@@ -0,0 +1,71 @@
+﻿# region License
+"""
+ * SimplRPA - A simple RPA library for Python and C#
+ *
+ * Copyright (c) 2009-2021 Ziglag the Orc
+ * Modifications (c) as per Git change history
+ *
+ * This Source Code Form is subject to the terms of the Mozilla
+ * Public License, v. 2.0. If a copy of the MPL was not distributed
+ * with this file, You can obtain one at
+ * https://mozilla.org/MPL/2.0/.
+ *
+ * The above copyright notice and this permission notice shall be included in all copies or substantial
+ * portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT
+ * LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+ * IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+ * WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+ * SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+# endregion
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from _Platform_Convergence import Config
+
+_pool = None
+_workers = 0
+_lock = threading.Lock()
+
+
+def worker_count():
+    """
+    Returns the number of worker threads the configuration asks for. A value of 0 or less means one per core.
+    :return: int
+    """
+    workers = int(Config.worker_threads)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def get_pool():
+    """
+    Returns the shared thread pool, creating it on first use. If Config.worker_threads has changed since the pool was
+    created it is replaced, the old pool finishes its queued work in the background.
+    :return: ThreadPoolExecutor
+    """
+    global _pool, _workers
+    with _lock:
+        workers = worker_count()
+        if _pool is None or _workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='SimpleRpaWorker')
+            _workers = workers
+        return _pool
+
+
+def map_all(fn, items):
+    """
+    Runs the function over every item on the shared pool and returns the results in order. The work is done on the
+    calling thread when only one worker is configured.
+    :param fn: The function to call with each item.
+    :param items: The list of items to process.
+    :return: list
+    """
+    if worker_count() == 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    return list(get_pool().map(fn, items))